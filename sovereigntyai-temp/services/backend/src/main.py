@@ -1,6 +1,8 @@
 import os
 import sys
 import io
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 from fastapi import FastAPI
 from pydantic import BaseModel, constr
@@ -32,11 +34,26 @@ logger = FileLogger(
 )
 
 # Embeddings
-embeddings = LangchainEmbeddingProvider(
-    logger=logger,
-    secret_manager=secret_manager,
-    configuration_manager=configuration_manager,
-)
+if configuration_manager.get_value("langchain_embedding_provider.mode") == "in-process":
+    # imported here, so the torch stack is only needed where the model actually runs in-process
+    try:
+        from modules.sentence_transformer_embedding_provider import SentenceTransformerEmbeddingProvider
+    except ImportError as e:
+        raise ImportError(
+            f"The in-process embedding mode needs the packages in requirements-in-process.txt: {e}"
+        ) from e
+
+    embeddings = SentenceTransformerEmbeddingProvider(
+        logger=logger,
+        secret_manager=secret_manager,
+        configuration_manager=configuration_manager,
+    )
+else:
+    embeddings = LangchainEmbeddingProvider(
+        logger=logger,
+        secret_manager=secret_manager,
+        configuration_manager=configuration_manager,
+    )
 
 # Database Manager
 database_manager = PostgresDatabaseManager(
@@ -46,9 +63,10 @@ database_manager = PostgresDatabaseManager(
     embeddings=embeddings,
 )
 
-# Vector Store
+# Vector Store; questions are answered on the event loop, so the store queries the database asynchronously
 langchain_vector_store = database_manager.create_langchain_vector_store(
     collection_name="test_collection",
+    async_mode=True,
 )
 
 # LLM Client
@@ -63,8 +81,15 @@ llm_client = LangchainLlmClient(
     collection_name="test",
 )
 
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    yield
+    await embeddings.aclose()
+
+
 # Create an instance of FastAPI
-app = FastAPI(title="Backend")
+app = FastAPI(title="Backend", lifespan=lifespan)
 
 # Set CORS middleware
 # noinspection PyTypeChecker
@@ -82,6 +107,15 @@ async def redirect_to_docs():
     return RedirectResponse(url="/docs")
 
 
+@app.get("/status")
+async def read_root() -> dict:
+    return {
+        "message": "Backend is running",
+        "embeddings_connection_pool": embeddings.get_pool_statistics(),
+        "embeddings_endpoints": embeddings.get_endpoint_statistics(),
+    }
+
+
 class QuestionRequest(BaseModel):
     question: constr(min_length=1, max_length=5120)
 
@@ -94,7 +128,7 @@ class QuestionResponse(BaseModel):
 @app.post("/question", response_model=QuestionResponse)
 async def get_answer(request: QuestionRequest) -> QuestionResponse:
     question = request.question
-    answer, feedback_id = llm_client.ask_database(
+    answer, feedback_id = await llm_client.ask_database(
         5,
         0.2,
         question,
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from watchdog.events import FileSystemEvent, FileSystemEventHandler
+from watchdog.observers import Observer
+
+if TYPE_CHECKING:
+    from modules.file_logger import FileLogger
+
+
+class _EventHandler(FileSystemEventHandler):
+    # watchdog calls this from its observer thread, the events are handed over to the event loop
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_event: Callable[[FileSystemEvent], None]) -> None:
+        self._loop = loop
+        self._on_event = on_event
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        self._loop.call_soon_threadsafe(self._on_event, event)
+
+
+class DataDirectoryWatcher:
+    # feeds the paths changed under the data directory into incremental synchronisations: a burst of events is
+    # collected until the directory has been quiet for debounce seconds (or max_delay has passed), and a periodic
+    # full reconcile catches whatever the events missed, e.g. while the service was down or the inotify queue overflowed
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            directory: str,
+            synchronize: Callable[[set[str] | None], Awaitable[dict]],
+            debounce: float,
+            max_delay: float,
+            reconcile_interval: float,
+    ) -> None:
+        self._logger = logger
+        self._directory = directory
+        self._synchronize = synchronize
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._reconcile_interval = reconcile_interval
+        self._observer: Observer | None = None
+        self._task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+        self._pending: set[str] = set()
+        self._reconcile_requested = True
+        self._first_event_at = 0.0
+        self._last_event_at = 0.0
+        self._statistics = {
+            "events": 0,
+            "synchronizations": 0,
+            "reconciles": 0,
+            "failures": 0,
+            "last_result": None,
+            "last_lag_seconds": None,
+        }
+
+    async def start(self) -> None:
+        self._observer = Observer()
+        self._observer.schedule(
+            _EventHandler(asyncio.get_running_loop(), self._on_event), self._directory, recursive=True,
+        )
+        self._observer.start()
+        self._task = asyncio.create_task(self._run())
+        self._logger.info(f"Watching {self._directory} for changes")
+
+    async def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            await asyncio.to_thread(self._observer.join)
+            self._observer = None
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _on_event(self, event: FileSystemEvent) -> None:
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        self._statistics["events"] += 1
+        if event.is_directory:
+            # a directory moved or removed takes its files along without an event for each of them
+            if event.event_type != "modified":
+                self._reconcile_requested = True
+        else:
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if path and path.endswith(".txt"):
+                    self._pending.add(os.path.relpath(path, self._directory))
+
+        now = time.monotonic()
+        if not self._changed.is_set():
+            self._first_event_at = now
+        self._last_event_at = now
+        self._changed.set()
+
+    async def _run(self) -> None:
+        # the first pass is a reconcile, it picks up changes made while the service was not running
+        next_reconcile = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=max(0.0, next_reconcile - time.monotonic()))
+                await self._wait_for_quiet()
+            except TimeoutError:
+                self._reconcile_requested = True
+
+            self._changed.clear()
+            file_paths, self._pending = self._pending, set()
+            first_event_at = self._first_event_at
+
+            if self._reconcile_requested:
+                # a reconcile covers the pending paths as well
+                self._reconcile_requested = False
+                next_reconcile = time.monotonic() + self._reconcile_interval
+                await self._run_synchronization(None, "reconciles", first_event_at if file_paths else None)
+            elif file_paths:
+                await self._run_synchronization(file_paths, "synchronizations", first_event_at)
+
+    async def _wait_for_quiet(self) -> None:
+        while True:
+            now = time.monotonic()
+            quiet_at = min(self._last_event_at + self._debounce, self._first_event_at + self._max_delay)
+            if now >= quiet_at:
+                return
+            await asyncio.sleep(quiet_at - now)
+
+    async def _run_synchronization(
+            self,
+            file_paths: set[str] | None,
+            counter: str,
+            first_event_at: float | None,
+    ) -> None:
+        try:
+            result = await self._synchronize(file_paths)
+        except Exception as e:
+            self._logger.exception(f"Synchronizing changes of {self._directory} failed: {e}")
+            self._statistics["failures"] += 1
+            # the paths are retried with the next batch of events or the next reconcile
+            self._pending |= file_paths or set()
+            return
+
+        self._statistics[counter] += 1
+        self._statistics["last_result"] = result
+        if first_event_at is not None:
+            # from the first event of the batch until its files are stored
+            self._statistics["last_lag_seconds"] = round(time.monotonic() - first_event_at, 3)
+
+    def get_statistics(self) -> dict:
+        return {
+            "directory": self._directory,
+            "pending": len(self._pending),
+            **self._statistics,
+        }
@@ -1,22 +1,23 @@
 from __future__ import annotations
 
+import asyncio
 import glob
 import os
-from typing import TYPE_CHECKING
-import hashlib
+from typing import TYPE_CHECKING, Iterator
 import logging
-import mimetypes
 from datetime import datetime, timezone
 from pathlib import Path
 
-import langdetect
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langdetect import detect
-from sqlalchemy import create_engine, Table, Column, String, MetaData
+from sqlalchemy import BigInteger, Index, Table, Column, String, MetaData, bindparam, delete, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from modules.language_identifier import LanguageIdentifier
+
+from ingestion_engine import IngestionEngine
 
 if TYPE_CHECKING:
     from langchain_postgres.vectorstores import PGVector
+    from sqlalchemy.engine import Connection, Engine
 
     from modules.configuration_manager import ConfigurationManager
     from modules.file_logger import FileLogger
@@ -25,6 +26,41 @@ if TYPE_CHECKING:
 
 class DataProcessor:
 
+    _DELETE_UNREFERENCED_CHUNKS = text(
+        "DELETE FROM langchain_pg_embedding AS e "
+        "WHERE e.id IN :chunk_ids "
+        "AND e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :collection_name) "
+        "AND NOT EXISTS (SELECT 1 FROM file_chunks AS fc WHERE fc.chunk_id = e.id)"
+    ).bindparams(bindparam("chunk_ids", expanding=True))
+    _DELETE_UNREFERENCED_FILE_VECTORS = text(
+        "DELETE FROM langchain_pg_embedding AS e "
+        "WHERE e.cmetadata ->> 'file_path' IN :file_paths "
+        "AND e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :collection_name) "
+        "AND NOT EXISTS (SELECT 1 FROM file_chunks AS fc WHERE fc.chunk_id = e.id)"
+    ).bindparams(bindparam("file_paths", expanding=True))
+    # vectors stored with empty metadata, before the chunks carried their file, can never be matched to a file
+    _DELETE_VECTORS_WITHOUT_FILE_PATH = text(
+        "DELETE FROM langchain_pg_embedding AS e "
+        "WHERE e.cmetadata ->> 'file_path' IS NULL "
+        "AND e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :collection_name)"
+    )
+    # the metadata of a shared chunk is that of one of its files, preferably the one it already names
+    _UPDATE_SHARED_CHUNK_METADATA = text(
+        "UPDATE langchain_pg_embedding AS e "
+        "SET cmetadata = e.cmetadata || jsonb_build_object("
+        "'file_path', f.file_path, 'file_name', f.file_name, 'file_hash', f.file_hash, "
+        "'language', f.language, 'source_file_name', f.source_file_name) "
+        "FROM ("
+        "SELECT DISTINCT ON (named.id) named.id, fc.file_path FROM langchain_pg_embedding AS named "
+        "JOIN file_chunks AS fc ON fc.chunk_id = named.id "
+        "WHERE named.cmetadata ->> 'file_path' IN :file_paths "
+        "AND named.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :collection_name) "
+        "ORDER BY named.id, fc.file_path <> named.cmetadata ->> 'file_path', fc.file_path"
+        ") AS c "
+        "JOIN files_metadata AS f ON f.file_path = c.file_path "
+        "WHERE e.id = c.id"
+    ).bindparams(bindparam("file_paths", expanding=True))
+
     def __init__(  # noqa: PLR0913
             self,
             logger: FileLogger,
@@ -32,6 +68,7 @@ class DataProcessor:
             configuration_manager: ConfigurationManager,
             data_directory: Path,
             langchain_vector_store: PGVector,
+            database_engine: Engine,
             chunk_size: int,
             chunk_overlap: int,
     ) -> None:
@@ -40,348 +77,368 @@ class DataProcessor:
         self._secret_manager = secret_manager
         self._DATA_DIRECTORY = data_directory
         self._LANGCHAIN_VECTOR_STORE = langchain_vector_store
-        self._SUPPORTED_MIME_TYPES = ("text/plain",)
-        self._TEXT_SPLITTER = RecursiveCharacterTextSplitter(
-            # separators=[
-            #     ".\n\n",
-            #     ".\r\n\r\n",
-            #     "\n\n",
-            #     "\r\n\r\n",
-            #     # optional
-            #     ".\n",
-            #     ".\r\n",
-            # ],
+        self._DATABASE_ENGINE = database_engine
+        self._METADATA = MetaData()
+        # Assuming a metadata table with file_path, file_name, and file_hash; file_size and file_mtime_ns
+        # are the stat the file had when it was hashed, so unchanged files are not read again
+        self._FILES_METADATA_TABLE = Table(
+            "files_metadata", self._METADATA,
+            Column("file_path", String, primary_key=True),
+            Column("file_name", String),
+            Column("file_hash", String),
+            Column("language", String),
+            Column("source_file_name", String),
+            Column("file_size", BigInteger),
+            Column("file_mtime_ns", BigInteger),
+            # file_path lookups use the primary key
+            Index("ix_files_metadata_file_hash", "file_hash"),
+        )
+        # chunks are stored once per distinct content (the vector id is the chunk's hash), this table records
+        # which files contain which chunks, so a vector is only deleted once no file references it anymore
+        self._FILE_CHUNKS_TABLE = Table(
+            "file_chunks", self._METADATA,
+            Column("file_path", String, primary_key=True),
+            Column("chunk_id", String, primary_key=True),
+            Index("ix_file_chunks_chunk_id", "chunk_id"),
+        )
+        # the API jobs and the directory watcher write the same tables, so their runs take turns
+        self._SYNCHRONIZATION_LOCK = asyncio.Lock()
+        self._INGESTION_ENGINE = IngestionEngine(
+            logger=logger,
+            embeddings=langchain_vector_store.embeddings,
+            langchain_vector_store=langchain_vector_store,
+            language_identifier=LanguageIdentifier(
+                sample_size=int(configuration_manager.get_value("language_identifier.sample_size")),
+                seed=int(configuration_manager.get_value("language_identifier.seed")),
+                languages=configuration_manager.get_values("language_identifier.languages"),
+            ),
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            length_function=len,
-            is_separator_regex=False,
+            parse_workers=int(configuration_manager.get_value("ingestion_engine.parse_workers")) or os.cpu_count(),
+            embedding_workers=int(configuration_manager.get_value("ingestion_engine.embedding_workers")),
+            insert_workers=int(configuration_manager.get_value("ingestion_engine.insert_workers")),
+            queue_size=int(configuration_manager.get_value("ingestion_engine.queue_size")),
+            embedding_batch_size=int(configuration_manager.get_value("ingestion_engine.embedding_batch_size")),
+            insert_batch_size=int(configuration_manager.get_value("ingestion_engine.insert_batch_size")),
+            streaming_threshold=int(configuration_manager.get_value("ingestion_engine.streaming_threshold")),
+            streaming_window=int(configuration_manager.get_value("ingestion_engine.streaming_window")),
         )
+        self._SUPPORTED_MIME_TYPES = ("text/plain",)
 
-    # class File:
-    #     def __init__(
-    #             self,
-    #             path: str,
-    #             name: str,
-    #             mime_type: str | None,
-    #             hash_value: str,
-    #     ) -> None:
-    #         self.path = path
-    #         self.name = name
-    #         self.mime_type = mime_type
-    #         self.hash = hash_value
-    #
-    # @staticmethod
-    # def _detect_file_type(file_path: Path) -> str | None:
-    #     mime_type, _ = mimetypes.guess_type(file_path)
-    #     return mime_type
-    #
-    # def _detect_file_language(self, file_path: str) -> str | None:
-    #     try:
-    #         with Path.open(Path(file_path), encoding="utf-8") as file:
-    #             file_content = file.read()
-    #             return langdetect.detect(file_content)
-    #     except (
-    #             FileNotFoundError,
-    #             Exception,
-    #             langdetect.lang_detect_exception.LangDetectException,
-    #     ) as e:
-    #         self._logger.info(f"Error occurred: {file_path}. Error: {e}")
-    #         return None
-    #
-    # def _create_file_list(self) -> list[File]:
-    #     all_files_and_dirs = sorted(self._DATA_DIRECTORY.rglob("*"))
-    #     all_files = [
-    #         file for file in all_files_and_dirs
-    #         if file.is_file() and self._detect_file_type(file) in
-    #            self._SUPPORTED_MIME_TYPES
-    #     ]
-    #     return [
-    #         self.File(
-    #             file_path.as_posix(),
-    #             file_path.name,
-    #             self._detect_file_type(file_path),
-    #             hashlib.sha256(
-    #                 file_path.read_bytes(),
-    #             ).hexdigest(),
-    #         )
-    #         for file_path in all_files
-    #     ]
-    #
-    # def _create_record_metadata_set(self) -> set[str]:
-    #     all_records = self._LANGCHAIN_VECTOR_STORE.get()
-    #     # all_records = self._LANGCHAIN_VECTOR_STORE.similarity_search("")
-    #
-    #     query = f"SELECT * FROM {self._LANGCHAIN_VECTOR_STORE.collection_name}"
-    #     all_records = self._LANGCHAIN_VECTOR_STORE.session.execute(query).fetchall()
-    #
-    #     record_metadata_set = set()
-    #
-    #     if not all_records:
-    #         return record_metadata_set
-    #
-    #     for record in all_records["metadatas"]:
-    #         file_path = record["file_path"]
-    #         if file_path:
-    #             record_metadata_set.add(file_path)
-    #     return record_metadata_set
-    #
-    # def _load_text_file(self, file: File) -> None:
-    #
-    #     source_file_name = None
-    #     try:
-    #         with open(file.path, "r", encoding="utf-8") as f:
-    #             source_file_name = f.readline().strip()
-    #     except Exception as e:
-    #         print(f"Error reading file: {e}")
-    #
-    #     loader = TextLoader(file.path, encoding="utf-8")
-    #
-    #     documents = loader.load_and_split()
-    #
-    #     if documents:
-    #         meta_data = {
-    #             "source_file_name": source_file_name,
-    #             "file_name": file.name,
-    #             "file_path": file.path,
-    #             "file_directory": Path(file.path).parts[1]
-    #             if len(Path(file.path).parts) > 1 else None,
-    #             "file_hash": file.hash,
-    #             "language": self._detect_file_language(file.path),
-    #         }
-    #
-    #         for document in documents:
-    #             document.metadata = meta_data
-    #
-    #         chunks = self._TEXT_SPLITTER.split_documents(documents)
-    #
-    #         self._LANGCHAIN_VECTOR_STORE.add_documents(
-    #             documents=chunks,
-    #         )
-    #
-    # def _delete_records_by_metadata(
-    #         self,
-    #         file_path: str | None,
-    #         file_hash: str | None = None,
-    # ) -> None:
-    #
-    #     records_to_delete = None
-    #
-    #     if file_path and file_hash:
-    #         result = self._LANGCHAIN_VECTOR_STORE.get(
-    #             where={
-    #                 "$and": [
-    #                     {"file_path": {"$eq": file_path}},
-    #                     {"file_hash": {"$ne": file_hash}},
-    #                 ],
-    #             },
-    #         )
-    #         records_to_delete = result["ids"]
-    #
-    #     if file_path and not file_hash:
-    #         result = self._LANGCHAIN_VECTOR_STORE.get(
-    #             where={"file_path": file_path},
-    #         )
-    #         records_to_delete = result["ids"]
-    #
-    #     if records_to_delete:
-    #         self._LANGCHAIN_VECTOR_STORE.delete(ids=records_to_delete)
-    #         message = f"Records for file: {file_path} have been deleted"
-    #     else:
-    #         message = (f"No invalid records found for deletion for file: "
-    #                    f"{file_path}")
-    #
-    #     self._logger.info(message)
-    #
-    # def _get_record_count_by_metadata(self, file: File) -> int:
-    #     result = self._LANGCHAIN_VECTOR_STORE.get(
-    #         where={
-    #             "$and": [
-    #                 {"file_path": {"$eq": file.path}},
-    #                 {"file_hash": {"$eq": file.hash}},
-    #             ],
-    #         },
-    #     )
-    #     return len(result["ids"])
-    #
-    # logging.basicConfig(
-    #     level=logging.INFO,
-    #     format="%(asctime)s - %(levelname)s - %(message)s",
-    # )
-    #
-    # async def synchronize_data_directory(self) -> str:
-    #     time_zone = timezone.utc
-    #     start_time = datetime.now(tz=time_zone)
-    #     logging.info(
-    #         f"Started at: "  # noqa: G004
-    #         f"{start_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
-    #     )
-    #
-    #     try:
-    #         file_list = self._create_file_list()
-    #         # record_metadata_set = self._create_record_metadata_set()
-    #     except Exception as e:
-    #         logging.exception(
-    #             f"Error creating file list or metadata set: "  # noqa: G004
-    #             f"{e}")  # noqa: TRY401
-    #         return "Error during initialization"
-    #
-    #     # delete records of nonexistent files
-    #
-    #     # for path in record_metadata_set:
-    #     #     try:
-    #     #         file_exists = any(file.path == path for file in file_list)
-    #     #         if not file_exists:
-    #     #             self._delete_records_by_metadata(path)
-    #     #     except Exception as e:
-    #     #         logging.exception(
-    #     #             f"Error deleting records for path "  # noqa: G004
-    #     #             f"{path}: {e}",  # noqa: TRY401
-    #     #         )
-    #
-    #     total_files = len(file_list)
-    #
-    #     for i, file in enumerate(file_list):
-    #         file_start_time = datetime.now(tz=time_zone)
-    #         logging.info(
-    #             f"Processing {file.name}... (started at "  # noqa: G004
-    #             f"{file_start_time.strftime('%Y-%m-%d %H:%M:%S')} "
-    #             f"UTC)",
-    #         )
-    #
-    #         try:
-    #             # delete records of files with changed content/hash
-    #             # self._delete_records_by_metadata(file.path, file.hash)
-    #
-    #             # check for records with metadata file_path and file_hash
-    #             # record_count = self._get_record_count_by_metadata(file)
-    #
-    #             # TODO(Pavel): fix synchronization
-    #             # temporarily solution
-    #
-    #             # insert file if it is missing
-    #             record_count = 0
-    #             if record_count == 0:  # noqa: SIM102
-    #                 if file.mime_type == "text/plain":
-    #                     self._load_text_file(file)
-    #
-    #             file_end_time = datetime.now(tz=time_zone)
-    #             file_duration = ((file_end_time - file_start_time)
-    #                              .total_seconds())
-    #             progress_percentage = ((i + 1) / total_files) * 100
-    #             logging.info(
-    #                 f"\rProcessed {file.name}, "  # noqa: G004
-    #                 f"{file_duration:.2f} seconds, {i + 1}/"
-    #                 f"{total_files}, "
-    #                 f"{progress_percentage:.2f}% done")
-    #
-    #         except Exception as e:
-    #             logging.exception(
-    #                 f"Error processing file "  # noqa: G004
-    #                 f"{file.name}: {e}",  # noqa: TRY401
-    #             )
-    #
-    #     end_time = datetime.now(tz=time_zone)
-    #     duration = end_time - start_time
-    #     logging.info(
-    #         f"Finished at: "  # noqa: G004
-    #         f"{end_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
-    #     )
-    #     logging.info(f"Total duration: {duration}")  # noqa: G004
-    #
-    #     return "Synchronization complete"
+    def close(self) -> None:
+        self._INGESTION_ENGINE.close()
 
-    @staticmethod
-    def _calculate_file_hash(file_path):
-        sha256_hash = hashlib.sha256()
-        with open(file_path, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest()
+    def _create_tables(self) -> None:
+        with self._DATABASE_ENGINE.begin() as connection:
+            # a database without file_chunks was written before chunks were content addressed, it is migrated in
+            # the transaction that creates the table, so the migration runs exactly once
+            unaddressed = not inspect(connection).has_table("file_chunks")
+            self._METADATA.create_all(connection)
+            # tables created before these columns existed get them added
+            existing_columns = {column["name"] for column in inspect(connection).get_columns("files_metadata")}
+            for column, column_type in (
+                    ("file_size", "BIGINT"), ("file_mtime_ns", "BIGINT"), ("source_file_name", "VARCHAR"),
+            ):
+                if column not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE files_metadata ADD COLUMN {column} {column_type}"))
+            if unaddressed:
+                self._migrate_unaddressed_vectors(connection)
+        # create_all skips the indexes of tables that already exist
+        for table in (self._FILES_METADATA_TABLE, self._FILE_CHUNKS_TABLE):
+            for index in table.indexes:
+                index.create(self._DATABASE_ENGINE, checkfirst=True)
+        self._create_vector_indexes()
+
+    def _migrate_unaddressed_vectors(self, connection: Connection) -> None:
+        # the vectors of that database have random ids and no file references them. The ones without a file_path
+        # are deleted, and every file is ingested again: this stores its chunks content addressed, and
+        # _release_chunks then deletes the old vectors naming the file, or naming a file that is gone
+        deleted = connection.execute(
+            self._DELETE_VECTORS_WITHOUT_FILE_PATH,
+            {"collection_name": self._LANGCHAIN_VECTOR_STORE.collection_name},
+        ).rowcount
+        forgotten = connection.execute(
+            self._FILES_METADATA_TABLE.update().values(file_hash=None, file_size=None, file_mtime_ns=None)
+        ).rowcount
+        self._logger.info(
+            f"Migrated to content addressed chunks: deleted {deleted} vectors without a file, "
+            f"{forgotten} files are ingested again"
+        )
+
+    def _create_vector_indexes(self) -> None:
+        # vectors are deleted by their file's path, which the GIN index on cmetadata does not serve
+        with self._LANGCHAIN_VECTOR_STORE.session_maker() as session:
+            session.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_file_path "
+                "ON langchain_pg_embedding ((cmetadata ->> 'file_path'))"
+            ))
+            session.commit()
+
+    def _upsert_files(self, rows: list[dict]) -> list[str]:
+        # the files' chunk references are replaced together with their metadata; the chunks they referenced
+        # before are returned, _release_chunks deletes the ones nothing references anymore
+        metadata_table = self._FILES_METADATA_TABLE
+        chunks_table = self._FILE_CHUNKS_TABLE
+        statement = insert(metadata_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=["file_path"],
+            set_={
+                column: statement.excluded[column]
+                for column in ("file_name", "file_hash", "language", "source_file_name", "file_size", "file_mtime_ns")
+            },
+        )
+        references = [
+            {"file_path": row["file_path"], "chunk_id": chunk_id}
+            for row in rows
+            for chunk_id in dict.fromkeys(row["chunk_ids"])
+        ]
+        with self._DATABASE_ENGINE.begin() as connection:
+            connection.execute(statement, [
+                {key: value for key, value in row.items() if key != "chunk_ids"} for row in rows
+            ])
+            released = list(connection.execute(
+                delete(chunks_table)
+                .where(chunks_table.c.file_path.in_([row["file_path"] for row in rows]))
+                .returning(chunks_table.c.chunk_id)
+            ).scalars())
+            if references:
+                connection.execute(insert(chunks_table), references)
+        return released
+
+    def _delete_files(self, file_paths: list[str]) -> list[str]:
+        # returns the chunks the files referenced, like _upsert_files
+        released = []
+        with self._DATABASE_ENGINE.begin() as connection:
+            for start in range(0, len(file_paths), 1000):
+                released.extend(connection.execute(
+                    delete(self._FILE_CHUNKS_TABLE)
+                    .where(self._FILE_CHUNKS_TABLE.c.file_path.in_(file_paths[start:start + 1000]))
+                    .returning(self._FILE_CHUNKS_TABLE.c.chunk_id)
+                ).scalars())
+                connection.execute(
+                    delete(self._FILES_METADATA_TABLE).where(
+                        self._FILES_METADATA_TABLE.c.file_path.in_(file_paths[start:start + 1000])
+                    )
+                )
+        return released
+
+    def _release_chunks(self, chunk_ids: list[str], file_paths: list[str]) -> None:
+        # runs after the ingestion, when every file of the run references its chunks, so a chunk that moved
+        # from one file to another (a renamed file) is kept. file_paths are the changed and removed files:
+        # vectors naming them that no file references are deleted as well, this also covers the vectors
+        # _migrate_unaddressed_vectors leaves, and the shared vectors that named them are pointed at a file
+        # that still contains the chunk
+        parameters = {"collection_name": self._LANGCHAIN_VECTOR_STORE.collection_name}
+        with self._DATABASE_ENGINE.begin() as connection:
+            for start in range(0, len(chunk_ids), 1000):
+                connection.execute(
+                    self._DELETE_UNREFERENCED_CHUNKS, {**parameters, "chunk_ids": chunk_ids[start:start + 1000]}
+                )
+            for start in range(0, len(file_paths), 1000):
+                file_path_parameters = {**parameters, "file_paths": file_paths[start:start + 1000]}
+                connection.execute(self._DELETE_UNREFERENCED_FILE_VECTORS, file_path_parameters)
+                connection.execute(self._UPDATE_SHARED_CHUNK_METADATA, file_path_parameters)
+
+    def _update_stats(self, stats: list[dict]) -> None:
+        table = self._FILES_METADATA_TABLE
+        statement = table.update().where(table.c.file_path == bindparam("path")).values(
+            file_size=bindparam("size"), file_mtime_ns=bindparam("mtime_ns"),
+        )
+        with self._DATABASE_ENGINE.begin() as connection:
+            connection.execute(statement, stats)
+
+    def _load_known_hashes(self) -> set[str]:
+        with self._DATABASE_ENGINE.connect() as connection:
+            return set(connection.execute(select(self._FILES_METADATA_TABLE.c.file_hash).distinct()).scalars())
+
+    def _load_manifest(self, file_paths: list[str] | None = None) -> dict[str, tuple[int | None, int | None, str]]:
+        table = self._FILES_METADATA_TABLE
+        query = select(table.c.file_path, table.c.file_size, table.c.file_mtime_ns, table.c.file_hash)
+        with self._DATABASE_ENGINE.connect() as connection:
+            if file_paths is None:
+                rows = connection.execute(query).all()
+            else:
+                rows = [
+                    row
+                    for start in range(0, len(file_paths), 1000)
+                    for row in connection.execute(query.where(table.c.file_path.in_(file_paths[start:start + 1000])))
+                ]
+            return {
+                file_path: (file_size, file_mtime_ns, file_hash)
+                for file_path, file_size, file_mtime_ns, file_hash in rows
+            }
 
     @staticmethod
-    def _detect_language(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
-        try:
-            return detect(file_content)
-        except Exception as e:
-            return "unknown"
+    def _scan_directory(directory: str) -> dict[str, tuple[str, int, int]]:
+        # relative path -> (path, size, mtime_ns); scandir entries carry their stat, so no file is opened
+        files = {}
+        directories = [directory]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.name.endswith(".txt") and entry.is_file():
+                        stat = entry.stat()
+                        files[os.path.relpath(entry.path, directory)] = (entry.path, stat.st_size, stat.st_mtime_ns)
+        return files
 
     @staticmethod
-    def _read_file_content(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+    def _stat_files(directory: str, file_paths: list[str]) -> dict[str, tuple[str, int, int]]:
+        # the same result as _scan_directory, restricted to the given relative paths
+        files = {}
+        for file_path in file_paths:
+            path = os.path.join(directory, file_path)
+            try:
+                stat = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            if file_path.endswith(".txt") and os.path.isfile(path):
+                files[file_path] = (path, stat.st_size, stat.st_mtime_ns)
+        return files
 
-    async def upload_data_from_folder(self) -> list:
+    async def synchronize_data_directory(
+            self,
+            progress: dict | None = None,
+            file_paths: set[str] | None = None,
+    ) -> dict:
+        # without file_paths the whole directory is reconciled, otherwise only those relative paths are
+        async with self._SYNCHRONIZATION_LOCK:
+            return await self._synchronize(progress, sorted(file_paths) if file_paths is not None else None)
+
+    async def _synchronize(self, progress: dict | None, file_paths: list[str] | None) -> dict:
         time_zone = timezone.utc
         start_time = datetime.now(tz=time_zone)
-        logging.info(
-            f"Started at: "  # noqa: G004
-            f"{start_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
+        directory = self._configuration_manager.get_value("persistent-volume.data_directory")
+
+        await asyncio.to_thread(self._create_tables)
+        manifest, files = await asyncio.gather(
+            asyncio.to_thread(self._load_manifest, file_paths),
+            asyncio.to_thread(self._scan_directory, directory) if file_paths is None
+            else asyncio.to_thread(self._stat_files, directory, file_paths),
         )
 
-        directory = self._configuration_manager.get_value("persistent-volume.data_directory")
-        files = glob.glob(f"{directory}/**/*.txt", recursive=True)
-
-        print(files)
-
-        file_list = [
-            (
-                os.path.relpath(os.path.dirname(file), directory),
-                os.path.basename(file),
-                self._calculate_file_hash(file),
-                self._detect_language(file),
-                self._read_file_content(file)
-            ) for file in files
+        removed = [file_path for file_path in manifest if file_path not in files]
+        changed = [
+            (path, file_path) for file_path, (path, size, mtime_ns) in files.items()
+            if manifest.get(file_path, (None, None, None))[:2] != (size, mtime_ns)
         ]
+        self._logger.info(
+            f"Synchronizing {directory if file_paths is None else f'{len(file_paths)} paths of {directory}'}: "
+            f"{len(files)} files, {len(changed)} new or changed, {len(removed)} removed"
+        )
 
+        if progress is not None:
+            progress["files_total"] = len(changed)
+            progress["files_removed"] = len(removed)
+        released = []
+        if removed:
+            released.extend(await asyncio.to_thread(self._delete_files, removed))
 
-        engine = create_engine(self._configuration_manager.get_value("database.connection_string"))
-        metadata = MetaData()
+        touched = []
+        accepted = []
 
-        # Assuming a metadata table with file_path, file_name, and file_hash
-        files_metadata_table = Table(
-            "files_metadata", metadata,
-            Column("file_path", String, primary_key=True),
-            Column("file_name", String),
-            Column("file_hash", String),
-            Column("language", String)
-        )
+        def should_ingest(parsed: dict) -> bool:
+            file_path = parsed["file_path"]
+            known = manifest.get(file_path)
+            if known is not None and known[2] == parsed["file_hash"]:
+                # only the stat changed, the stored vectors are still valid
+                touched.append(file_path)
+                return False
+            accepted.append(file_path)
+            return True
 
-        with engine.connect() as connection:
-            for file_path, file_name, file_hash, language, file_content in file_list:
-                result = connection.execute(
-                    files_metadata_table.select().where(files_metadata_table.c.file_hash == file_hash)
-                ).fetchone()
+        def mark_processed(rows: list[dict]) -> None:
+            released.extend(self._upsert_files([self._with_stat(row, files) for row in rows]))
 
-                if result:
-                    self._logger.info(f"File {file_name} already processed. Skipping.")
-                    continue
+        ingested = []
+        if changed:
+            ingested = await self._INGESTION_ENGINE.run(
+                files=changed,
+                should_ingest=should_ingest,
+                mark_processed=mark_processed,
+                progress=progress,
+            )
+        if touched:
+            await asyncio.to_thread(self._update_stats, [
+                {"path": file_path, "size": files[file_path][1], "mtime_ns": files[file_path][2]}
+                for file_path in touched
+            ])
+        if released or removed or accepted:
+            await asyncio.to_thread(self._release_chunks, sorted(set(released)), removed + accepted)
 
-                # If not processed, insert metadata and optionally process further
-                connection.execute(
-                    files_metadata_table.insert().values(
-                        file_path=file_path,
-                        file_name=file_name,
-                        file_hash=file_hash,
-                        language=language
-                    )
-                )
+        duration = datetime.now(tz=time_zone) - start_time
+        result = {
+            "files": len(files),
+            "unchanged": len(files) - len(changed),
+            "ingested": len(ingested),
+            "touched": len(touched),
+            "removed": len(removed),
+            "failed": len(changed) - len(ingested) - len(touched),
+            "duration_seconds": duration.total_seconds(),
+        }
+        self._logger.info(f"Synchronization finished: {result}")
+        return result
 
-                # Optional: Process file content (e.g., store chunks in the vector store)
-                chunks = self._TEXT_SPLITTER.split_text(file_content)
-                for chunk in chunks:
-                    self._LANGCHAIN_VECTOR_STORE.add_texts([chunk])
-                    self._logger.info(f"Added chunk for file {file_name}.")
+    @staticmethod
+    def _with_stat(row: dict, files: dict[str, tuple[str, int, int]]) -> dict:
+        _, size, mtime_ns = files[row["file_path"]]
+        return {**row, "file_size": size, "file_mtime_ns": mtime_ns}
+
+    @staticmethod
+    def _iterate_files(directory: str) -> Iterator[tuple[str, str]]:
+        # lazily, the parser processes read each file while the listing continues
+        for file in glob.iglob(f"{directory}/**/*.txt", recursive=True):
+            yield file, os.path.relpath(file, directory)
 
+    async def upload_data_from_folder(self, progress: dict | None = None) -> list:
+        async with self._SYNCHRONIZATION_LOCK:
+            return await self._upload_data_from_folder(progress)
 
-                end_time = datetime.now(tz=time_zone)
-                duration = end_time - start_time
-                logging.info(
-                    f"Finished at: "  # noqa: G004
-                    f"{end_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
-                )
-                logging.info(f"Total duration: {duration}")  # noqa: G004
+    async def _upload_data_from_folder(self, progress: dict | None) -> list:
+        time_zone = timezone.utc
+        start_time = datetime.now(tz=time_zone)
+        logging.info(
+            f"Started at: "  # noqa: G004
+            f"{start_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
+        )
+
+        directory = self._configuration_manager.get_value("persistent-volume.data_directory")
+        await asyncio.to_thread(self._create_tables)
+        # one query up front instead of one per file; hashes ingested during this run are added as well
+        known_hashes = await asyncio.to_thread(self._load_known_hashes)
+        released = []
+        accepted = []
 
-                # return "Synchronization complete"
-                return file_list
+        def should_ingest(parsed: dict) -> bool:
+            if parsed["file_hash"] in known_hashes:
+                self._logger.info(f"File {parsed['file_name']} already processed. Skipping.")
+                return False
+            known_hashes.add(parsed["file_hash"])
+            accepted.append(parsed["file_path"])
+            return True
+
+        def mark_processed(rows: list[dict]) -> None:
+            released.extend(self._upsert_files(rows))
+
+        processed_files = await self._INGESTION_ENGINE.run(
+            files=self._iterate_files(directory),
+            should_ingest=should_ingest,
+            mark_processed=mark_processed,
+            progress=progress,
+        )
+        if released or accepted:
+            await asyncio.to_thread(self._release_chunks, sorted(set(released)), accepted)
+
+        end_time = datetime.now(tz=time_zone)
+        duration = end_time - start_time
+        logging.info(
+            f"Finished at: "  # noqa: G004
+            f"{end_time.strftime('%Y-%m-%d %H:%M:%S')} UTC",
+        )
+        logging.info(f"Total duration: {duration}")  # noqa: G004
+
+        return [
+            (file["file_path"], file["file_name"], file["file_hash"], file["language"])
+            for file in processed_files
+        ]
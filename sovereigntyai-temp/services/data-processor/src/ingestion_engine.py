@@ -0,0 +1,455 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import os
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from sqlalchemy import select
+
+from streaming_text_splitter import StreamingTextSplitter
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+    from langchain_postgres.vectorstores import PGVector
+
+    from modules.file_logger import FileLogger
+    from modules.language_identifier import LanguageIdentifier
+
+
+# set in every parser process by _initialize_parser, the splitter and the language profiles are loaded once per process
+_text_splitter: RecursiveCharacterTextSplitter | None = None
+_language_identifier: LanguageIdentifier | None = None
+_chunk_namespace = ""
+_streaming_threshold = 0
+
+
+def _initialize_parser(
+        chunk_size: int,
+        chunk_overlap: int,
+        language_identifier: LanguageIdentifier,
+        chunk_namespace: str,
+        streaming_threshold: int,
+) -> None:
+    global _text_splitter, _language_identifier, _chunk_namespace, _streaming_threshold
+    _text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    _language_identifier = language_identifier
+    _language_identifier.load()
+    _chunk_namespace = chunk_namespace
+    _streaming_threshold = streaming_threshold
+
+
+def _create_chunk_id(namespace: str, chunk: str) -> str:
+    # the id is the hash of the chunk with unicode and whitespace normalised, so identical text is stored once;
+    # the namespace keeps the ids of different collections apart, they share the embeddings table
+    normalized = " ".join(unicodedata.normalize("NFC", chunk).split())
+    return hashlib.sha256(f"{namespace}\n{normalized}".encode()).hexdigest()
+
+
+def _parse_file(file: str, file_path: str) -> dict:
+    # runs in a parser process: one read feeds the hash, the language detection and the splitter
+    if os.path.getsize(file) > _streaming_threshold:
+        return _parse_large_file(file, file_path)
+
+    with open(file, "rb") as f:
+        data = f.read()
+    file_hash = hashlib.sha256(data).hexdigest()
+    # same newline handling as opening the file in text mode
+    file_content = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+    language = _language_identifier.detect(file_content) or "unknown"
+    chunks = _text_splitter.split_text(file_content)
+
+    return {
+        "file_path": file_path,
+        "file_name": os.path.basename(file),
+        "file_hash": file_hash,
+        "language": language,
+        "source_file_name": file_content.split("\n", 1)[0].strip(),
+        "chunks": chunks,
+        "chunk_ids": [_create_chunk_id(_chunk_namespace, chunk) for chunk in chunks],
+    }
+
+
+def _parse_large_file(file: str, file_path: str) -> dict:
+    # a file too large to hold in memory is hashed block by block and its language detected on a sample;
+    # it is split later by the engine, a window at a time, instead of being sent back as one list of chunks
+    with open(file, "rb") as f:
+        file_hash = hashlib.file_digest(f, "sha256").hexdigest()
+        f.seek(0)
+        first_line = f.readline(65536).decode("utf-8", errors="ignore")
+
+    return {
+        "file_path": file_path,
+        "file_name": os.path.basename(file),
+        "file_hash": file_hash,
+        "language": _language_identifier.detect_file(file) or "unknown",
+        "source_file_name": first_line.replace("\r\n", "\n").replace("\r", "\n").split("\n", 1)[0].strip(),
+        "path": file,
+        "chunks": None,
+        "chunk_ids": None,
+    }
+
+
+class IngestionEngine:
+    # parse -> batch -> embed -> insert, connected by bounded queues so a slow stage holds back the ones before it
+
+    PROGRESS_COUNTERS = (
+        "files_parsed", "files_skipped", "files_completed", "files_failed",
+        "chunks_embedded", "chunks_reused", "chunks_stored",
+    )
+    # paths taken from the file listing per thread hop
+    LISTING_BATCH_SIZE = 256
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            embeddings: Embeddings,
+            langchain_vector_store: PGVector,
+            language_identifier: LanguageIdentifier,
+            chunk_size: int,
+            chunk_overlap: int,
+            parse_workers: int,
+            embedding_workers: int,
+            insert_workers: int,
+            queue_size: int,
+            embedding_batch_size: int,
+            insert_batch_size: int,
+            streaming_threshold: int,
+            streaming_window: int,
+    ) -> None:
+        self._logger = logger
+        self._embeddings = embeddings
+        self._langchain_vector_store = langchain_vector_store
+        self._language_identifier = language_identifier
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._parse_workers = parse_workers
+        self._embedding_workers = embedding_workers
+        self._insert_workers = insert_workers
+        self._queue_size = queue_size
+        self._embedding_batch_size = embedding_batch_size
+        self._insert_batch_size = insert_batch_size
+        self._streaming_threshold = streaming_threshold
+        self._streaming_splitter = StreamingTextSplitter(
+            text_splitter=RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                length_function=len,
+                is_separator_regex=False,
+            ),
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            window_size=streaming_window,
+        )
+        self._progress: dict = {}
+        # chunk id -> chunk of the running run that is not stored yet
+        self._scheduled: dict[str, dict] = {}
+        # kept between runs, small incremental runs would otherwise spend most of their time starting processes
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawned rather than forked, the service process already runs threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._parse_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialize_parser,
+                initargs=(
+                    self._chunk_size, self._chunk_overlap, self._language_identifier,
+                    self._langchain_vector_store.collection_name, self._streaming_threshold,
+                ),
+            )
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def run(
+            self,
+            files: Iterable[tuple[str, str]],
+            should_ingest: Callable[[dict], bool],
+            mark_processed: Callable[[list[dict]], None],
+            progress: dict | None = None,
+    ) -> list[dict]:
+        # files are (absolute path, relative path) pairs; should_ingest sees every parsed file before its
+        # chunks are batched, it and mark_processed do blocking database work and run in threads.
+        # progress is updated in place, so a caller can report on a run while it is going
+        started_at = time.perf_counter()
+        self._progress = progress if progress is not None else {}
+        self._scheduled = {}
+        for counter in self.PROGRESS_COUNTERS:
+            self._progress[counter] = 0
+        path_queue: asyncio.Queue[tuple[str, str] | None] = asyncio.Queue(self._queue_size)
+        parsed_queue: asyncio.Queue[dict | None] = asyncio.Queue(self._queue_size)
+        embedding_queue: asyncio.Queue[list[dict] | None] = asyncio.Queue(self._queue_size)
+        insert_queue: asyncio.Queue[tuple[list[dict], list[dict], list] | None] = asyncio.Queue(self._queue_size)
+        completed_files: list[dict] = []
+
+        pool = self._get_pool()
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(self._list_files(files, path_queue))
+            task_group.create_task(self._run_stage(
+                self._parse_workers, lambda: self._parse(pool, path_queue, parsed_queue), parsed_queue, 1,
+            ))
+            task_group.create_task(self._run_stage(
+                1,
+                lambda: self._batch(parsed_queue, embedding_queue, should_ingest, mark_processed, completed_files),
+                embedding_queue, self._embedding_workers,
+            ))
+            task_group.create_task(self._run_stage(
+                self._embedding_workers, lambda: self._embed(embedding_queue, insert_queue),
+                insert_queue, self._insert_workers,
+            ))
+            task_group.create_task(self._run_stage(
+                self._insert_workers, lambda: self._insert(insert_queue, mark_processed, completed_files),
+                None, 0,
+            ))
+
+        self._logger.info(
+            f"Ingested {len(completed_files)} files with "
+            f"{sum(file['chunks'] for file in completed_files)} chunks in {time.perf_counter() - started_at:.2f}s"
+        )
+        return completed_files
+
+    @staticmethod
+    async def _run_stage(
+            workers: int,
+            create_worker: Callable,
+            output_queue: asyncio.Queue | None,
+            consumers: int,
+    ) -> None:
+        # once every worker of a stage is done, each consumer of the next stage gets an end marker
+        await asyncio.gather(*(create_worker() for _ in range(workers)))
+        for _ in range(consumers):
+            await output_queue.put(None)
+
+    async def _list_files(self, files: Iterable[tuple[str, str]], path_queue: asyncio.Queue) -> None:
+        # files may be a lazy directory walk, which blocks on every directory it reads; it is advanced in a thread,
+        # so a large or network mounted tree does not hold up the stages behind it
+        iterator = iter(files)
+
+        def next_files() -> list[tuple[str, str]]:
+            return list(itertools.islice(iterator, self.LISTING_BATCH_SIZE))
+
+        while batch := await asyncio.to_thread(next_files):
+            for file in batch:
+                await path_queue.put(file)
+        for _ in range(self._parse_workers):
+            await path_queue.put(None)
+
+    async def _parse(self, pool: ProcessPoolExecutor, path_queue: asyncio.Queue, parsed_queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while (file := await path_queue.get()) is not None:
+            try:
+                parsed = await loop.run_in_executor(pool, _parse_file, *file)
+            except BrokenProcessPool as e:
+                # a crashed parser process takes the pool down, the next run starts a new one
+                self._logger.error(f"Failed to parse {file[1]}: {e}")
+                self._progress["files_failed"] += 1
+                if self._pool is pool:
+                    self._pool = None
+                    pool.shutdown(wait=False)
+                continue
+            except Exception as e:
+                self._logger.error(f"Failed to parse {file[1]}: {e}")
+                self._progress["files_failed"] += 1
+                continue
+            self._progress["files_parsed"] += 1
+            await parsed_queue.put(parsed)
+
+    async def _iterate_chunks(self, parsed: dict) -> AsyncIterator[tuple[str, str]]:
+        if parsed["chunks"] is not None:
+            for chunk_id, chunk in zip(parsed.pop("chunk_ids"), parsed.pop("chunks")):
+                yield chunk_id, chunk
+            return
+
+        # a large file is split in a thread while its chunks are batched, only the current window is in memory
+        namespace = self._langchain_vector_store.collection_name
+        chunks = self._streaming_splitter.split_file(parsed["path"])
+
+        def next_chunks() -> list[tuple[str, str]]:
+            return [
+                (_create_chunk_id(namespace, chunk), chunk)
+                for chunk in itertools.islice(chunks, self._embedding_batch_size)
+            ]
+
+        while items := await asyncio.to_thread(next_chunks):
+            for item in items:
+                yield item
+
+    async def _batch(
+            self,
+            parsed_queue: asyncio.Queue,
+            embedding_queue: asyncio.Queue,
+            should_ingest: Callable[[dict], bool],
+            mark_processed: Callable[[list[dict]], None],
+            completed_files: list[dict],
+    ) -> None:
+        # chunks of many files are packed into full embedding batches; every chunk points back to the files
+        # containing it, whose pending counts decide when a file is completely stored. A chunk already on its
+        # way to the store is not scheduled again, the file waits for it instead
+        batch: list[dict] = []
+
+        while (parsed := await parsed_queue.get()) is not None:
+            if not await asyncio.to_thread(should_ingest, parsed):
+                self._progress["files_skipped"] += 1
+                continue
+
+            # scheduling is set while the file still has chunks to come, the inserts of its first batches
+            # must not complete it
+            file = {
+                "row": self._create_file_row(parsed), "pending": 0, "failed": False, "scheduling": True, "chunks": 0,
+            }
+            chunk_metadata = {
+                "source_file_name": parsed["source_file_name"],
+                "file_name": parsed["file_name"],
+                "file_path": parsed["file_path"],
+                "file_hash": parsed["file_hash"],
+                "language": parsed["language"],
+            }
+            chunk_ids = file["row"]["chunk_ids"]
+            try:
+                async for chunk_id, chunk in self._iterate_chunks(parsed):
+                    file["chunks"] += 1
+                    # a chunk repeated within the file is stored once as well
+                    if chunk_id in chunk_ids:
+                        continue
+                    chunk_ids[chunk_id] = None
+
+                    entry = self._scheduled.get(chunk_id)
+                    if entry is None:
+                        entry = {"id": chunk_id, "text": chunk, "metadata": chunk_metadata, "files": []}
+                        self._scheduled[chunk_id] = entry
+                        batch.append(entry)
+                    entry["files"].append(file)
+                    file["pending"] += 1
+                    if len(batch) >= self._embedding_batch_size:
+                        await embedding_queue.put(batch)
+                        batch = []
+            except Exception as e:
+                self._logger.error(f"Failed to split {parsed['file_path']}: {e}")
+                self._fail_file(file)
+            file["scheduling"] = False
+
+            if not file["pending"] and not file["failed"]:
+                await asyncio.to_thread(mark_processed, [file["row"]])
+                completed_files.append(self._describe_file(file))
+                self._progress["files_completed"] += 1
+
+        if batch:
+            await embedding_queue.put(batch)
+
+    async def _embed(self, embedding_queue: asyncio.Queue, insert_queue: asyncio.Queue) -> None:
+        while (batch := await embedding_queue.get()) is not None:
+            try:
+                # chunks stored by an earlier run, or by another file of this one, keep their vectors
+                stored = await asyncio.to_thread(self._find_stored_chunks, [entry["id"] for entry in batch])
+                missing = [entry for entry in batch if entry["id"] not in stored]
+                embeddings = await self._embeddings.aembed_documents([entry["text"] for entry in missing]) \
+                    if missing else []
+            except Exception as e:
+                self._logger.error(f"Embedding of {len(batch)} chunks failed: {e}")
+                self._fail(batch)
+                continue
+            self._progress["chunks_embedded"] += len(missing)
+            self._progress["chunks_reused"] += len(batch) - len(missing)
+            await insert_queue.put((batch, missing, embeddings))
+
+    async def _insert(
+            self,
+            insert_queue: asyncio.Queue,
+            mark_processed: Callable[[list[dict]], None],
+            completed_files: list[dict],
+    ) -> None:
+        while (item := await insert_queue.get()) is not None:
+            batch, missing, embeddings = item
+            try:
+                if missing:
+                    await asyncio.to_thread(self._store, missing, embeddings)
+            except Exception as e:
+                self._logger.error(f"Storing {len(missing)} chunks failed: {e}")
+                self._fail(batch)
+                continue
+
+            self._progress["chunks_stored"] += len(missing)
+
+            # files are marked as processed only after all of their chunks are stored
+            completed = []
+            for entry in batch:
+                # from here on the chunk is found in the store
+                del self._scheduled[entry["id"]]
+                for file in entry["files"]:
+                    file["pending"] -= 1
+                    if file["pending"] == 0 and not file["failed"] and not file["scheduling"]:
+                        completed.append(file)
+            if completed:
+                await asyncio.to_thread(mark_processed, [file["row"] for file in completed])
+                completed_files.extend(self._describe_file(file) for file in completed)
+                self._progress["files_completed"] += len(completed)
+
+            self._logger.info(
+                f"Stored {len(missing)} chunks, reused {len(batch) - len(missing)}, completed {len(completed)} files."
+            )
+
+    def _find_stored_chunks(self, chunk_ids: list[str]) -> set[str]:
+        vector_store = self._langchain_vector_store
+        embedding_store = vector_store.EmbeddingStore
+        with vector_store.session_maker() as session:
+            return set(session.execute(select(embedding_store.id).where(embedding_store.id.in_(chunk_ids))).scalars())
+
+    def _store(self, batch: list[dict], embeddings: list[list[float]]) -> None:
+        # add_embeddings writes each slice as one multi-row INSERT in its own transaction, upserting on the chunk id
+        for start in range(0, len(batch), self._insert_batch_size):
+            end = start + self._insert_batch_size
+            self._langchain_vector_store.add_embeddings(
+                texts=[entry["text"] for entry in batch[start:end]],
+                embeddings=embeddings[start:end],
+                metadatas=[entry["metadata"] for entry in batch[start:end]],
+                ids=[entry["id"] for entry in batch[start:end]],
+            )
+
+    def _fail(self, batch: list[dict]) -> None:
+        for entry in batch:
+            self._scheduled.pop(entry["id"], None)
+            for file in entry["files"]:
+                self._fail_file(file)
+
+    def _fail_file(self, file: dict) -> None:
+        # the file stays unprocessed, so the next run picks it up again
+        if not file["failed"]:
+            file["failed"] = True
+            self._progress["files_failed"] += 1
+
+    @staticmethod
+    def _create_file_row(parsed: dict) -> dict:
+        return {
+            "file_path": parsed["file_path"],
+            "file_name": parsed["file_name"],
+            "file_hash": parsed["file_hash"],
+            "language": parsed["language"],
+            "source_file_name": parsed["source_file_name"],
+            # filled while the file is batched, in order and without repeats
+            "chunk_ids": {},
+        }
+
+    @staticmethod
+    def _describe_file(file: dict) -> dict:
+        return {
+            **{key: value for key, value in file["row"].items() if key != "chunk_ids"},
+            "chunks": file["chunks"],
+        }
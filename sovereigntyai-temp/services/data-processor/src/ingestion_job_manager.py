@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from sqlalchemy import JSON, Column, DateTime, Integer, MetaData, String, Table, select
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+    from modules.file_logger import FileLogger
+
+
+class IngestionJobManager:
+    # runs one ingestion job at a time in the background; the ingestion_jobs table is the checkpoint,
+    # a job that was running when the pod stopped is resumed on the next start, and because files are
+    # only recorded after their chunks are committed the resumed run continues after the last stored batch
+
+    STATES = ("running", "interrupted", "completed", "failed", "cancelled")
+
+    def __init__(
+            self,
+            logger: FileLogger,
+            database_engine: Engine,
+            jobs: dict[str, Callable[[dict], Awaitable[object]]],
+            checkpoint_interval: float,
+    ) -> None:
+        self._logger = logger
+        self._database_engine = database_engine
+        self._jobs = jobs
+        self._checkpoint_interval = checkpoint_interval
+        self._metadata = MetaData()
+        self._jobs_table = Table(
+            "ingestion_jobs", self._metadata,
+            Column("job_id", String, primary_key=True),
+            Column("kind", String, nullable=False),
+            Column("state", String, nullable=False),
+            Column("attempts", Integer, nullable=False),
+            Column("started_at", DateTime(timezone=True)),
+            Column("updated_at", DateTime(timezone=True)),
+            Column("finished_at", DateTime(timezone=True)),
+            Column("progress", JSON),
+            Column("result", JSON),
+            Column("error", String),
+        )
+        self._task: asyncio.Task | None = None
+        self._job: dict | None = None
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._metadata.create_all, self._database_engine)
+        interrupted = await asyncio.to_thread(self._load_unfinished_job)
+        if interrupted is not None:
+            self._logger.info(f"Resuming {interrupted['kind']} job {interrupted['job_id']}")
+            await self.start_job(interrupted["kind"], interrupted["job_id"], interrupted["attempts"] + 1)
+
+    async def stop(self) -> None:
+        # a redeploy interrupts rather than cancels, so the job resumes on the next start
+        if self._task is not None and not self._task.done():
+            self._job["stopping"] = True
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def start_job(self, kind: str, job_id: str | None = None, attempts: int = 1) -> dict:
+        if kind not in self._jobs:
+            raise ValueError(f"Invalid job kind: {kind}. Expected one of {tuple(self._jobs)}.")
+        if self._task is not None and not self._task.done():
+            raise RuntimeError(f"Job {self._job['job_id']} is still running.")
+
+        now = datetime.now(tz=timezone.utc)
+        self._job = {
+            "job_id": job_id or uuid.uuid4().hex,
+            "kind": kind,
+            "state": "running",
+            "attempts": attempts,
+            "started_at": now,
+            "updated_at": now,
+            "finished_at": None,
+            "progress": {},
+            "result": None,
+            "error": None,
+            "stopping": False,
+            "started": time.perf_counter(),
+        }
+        await asyncio.to_thread(self._save, self._job)
+        self._task = asyncio.create_task(self._run(self._job))
+        # let the job reach its try block, a task cancelled before its first step would never record its state
+        await asyncio.sleep(0)
+        return self._describe(self._job)
+
+    async def _run(self, job: dict) -> None:
+        self._logger.set_job_id(job["job_id"])
+        self._logger.info(f"Started {job['kind']} job {job['job_id']} (attempt {job['attempts']})")
+        checkpoints = asyncio.create_task(self._write_checkpoints(job))
+        try:
+            job["result"] = await self._jobs[job["kind"]](job["progress"])
+            job["state"] = "completed"
+        except asyncio.CancelledError:
+            job["state"] = "interrupted" if job["stopping"] else "cancelled"
+        except Exception as e:
+            self._logger.exception(f"Job {job['job_id']} failed: {e}")
+            job["state"] = "failed"
+            job["error"] = str(e)
+        finally:
+            checkpoints.cancel()
+            if job["state"] != "interrupted":
+                job["finished_at"] = datetime.now(tz=timezone.utc)
+            await asyncio.to_thread(self._save, job)
+            self._logger.info(f"Job {job['job_id']} {job['state']}: {self._get_throughput(job)}")
+            self._logger.set_job_id("")
+
+    async def _write_checkpoints(self, job: dict) -> None:
+        while True:
+            await asyncio.sleep(self._checkpoint_interval)
+            await asyncio.to_thread(self._save, job)
+
+    def _save(self, job: dict) -> None:
+        job["updated_at"] = datetime.now(tz=timezone.utc)
+        row = {column.name: job[column.name] for column in self._jobs_table.columns}
+        # progress is mutated by the running job, the checkpoint stores a snapshot
+        row["progress"] = dict(job["progress"])
+        with self._database_engine.begin() as connection:
+            updated = connection.execute(
+                self._jobs_table.update().where(self._jobs_table.c.job_id == job["job_id"]).values(row)
+            ).rowcount
+            if not updated:
+                connection.execute(self._jobs_table.insert().values(row))
+
+    def cancel_job(self, job_id: str) -> dict | None:
+        if self._job is None or self._job["job_id"] != job_id:
+            return None
+        if not self._task.done():
+            self._task.cancel()
+        return self._describe(self._job)
+
+    # the queries run on worker threads, the event loop also runs the ingestion pipeline and the watcher
+
+    def _load_unfinished_job(self) -> dict | None:
+        with self._database_engine.connect() as connection:
+            row = connection.execute(
+                select(self._jobs_table).where(self._jobs_table.c.state.in_(("running", "interrupted")))
+                .order_by(self._jobs_table.c.started_at.desc())
+            ).mappings().first()
+        return dict(row) if row is not None else None
+
+    def _load_job(self, job_id: str) -> dict | None:
+        with self._database_engine.connect() as connection:
+            row = connection.execute(
+                select(self._jobs_table).where(self._jobs_table.c.job_id == job_id)
+            ).mappings().first()
+        return dict(row) if row is not None else None
+
+    def _load_job_summaries(self, limit: int) -> list[dict]:
+        # without the result column, results grow with the ingested data and are only returned per job
+        columns = [column for column in self._jobs_table.columns if column.name != "result"]
+        with self._database_engine.connect() as connection:
+            rows = connection.execute(
+                select(*columns).order_by(self._jobs_table.c.started_at.desc()).limit(limit)
+            ).mappings().all()
+        return [dict(row) for row in rows]
+
+    async def get_job(self, job_id: str) -> dict | None:
+        if self._job is not None and self._job["job_id"] == job_id:
+            return self._describe(self._job)
+
+        job = await asyncio.to_thread(self._load_job, job_id)
+        return self._describe(job) if job is not None else None
+
+    async def list_jobs(self, limit: int = 20) -> list[dict]:
+        jobs = await asyncio.to_thread(self._load_job_summaries, limit)
+        # the job in this process has fresher progress than its last checkpoint
+        return [
+            self._describe(
+                self._job if self._job is not None and job["job_id"] == self._job["job_id"] else job,
+                with_result=False,
+            )
+            for job in jobs
+        ]
+
+    @staticmethod
+    def _get_throughput(job: dict) -> dict:
+        progress = job["progress"] or {}
+        if job["finished_at"] is None and "started" in job:
+            elapsed = time.perf_counter() - job["started"]
+        else:
+            elapsed = ((job["finished_at"] or job["updated_at"]) - job["started_at"]).total_seconds()
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_second": round(progress.get("files_completed", 0) / elapsed, 3) if elapsed > 0 else 0.0,
+            "chunks_per_second": round(progress.get("chunks_stored", 0) / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+
+    def _describe(self, job: dict, with_result: bool = True) -> dict:
+        description = {
+            "job_id": job["job_id"],
+            "kind": job["kind"],
+            "state": job["state"],
+            "attempts": job["attempts"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "progress": dict(job["progress"] or {}),
+            "throughput": self._get_throughput(job),
+            "error": job["error"],
+        }
+        if with_result:
+            description["result"] = job["result"]
+        return description
@@ -1,6 +1,8 @@
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import AsyncIterator
 
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, HTTPException
 from starlette.responses import RedirectResponse
 
 from modules.configuration_manager import ConfigurationManager
@@ -9,9 +11,9 @@ from modules.langchain_embedding_provider import LangchainEmbeddingProvider
 from modules.postgres_database_manager import PostgresDatabaseManager
 from modules.os_environment_secret_manager import OsEnvironmentSecretManager
 
+from data_directory_watcher import DataDirectoryWatcher
 from data_processor import DataProcessor
-
-app = FastAPI(title="Data Processor")
+from ingestion_job_manager import IngestionJobManager
 
 configuration_manager = ConfigurationManager()
 
@@ -22,11 +24,26 @@ logger = FileLogger(
 
 secret_manager = OsEnvironmentSecretManager()
 
-embeddings = LangchainEmbeddingProvider(
-    logger=logger,
-    secret_manager=secret_manager,
-    configuration_manager=configuration_manager,
-)
+if configuration_manager.get_value("langchain_embedding_provider.mode") == "in-process":
+    # imported here, so the torch stack is only needed where the model actually runs in-process
+    try:
+        from modules.sentence_transformer_embedding_provider import SentenceTransformerEmbeddingProvider
+    except ImportError as e:
+        raise ImportError(
+            f"The in-process embedding mode needs the packages in requirements-in-process.txt: {e}"
+        ) from e
+
+    embeddings = SentenceTransformerEmbeddingProvider(
+        logger=logger,
+        secret_manager=secret_manager,
+        configuration_manager=configuration_manager,
+    )
+else:
+    embeddings = LangchainEmbeddingProvider(
+        logger=logger,
+        secret_manager=secret_manager,
+        configuration_manager=configuration_manager,
+    )
 
 database_manager = PostgresDatabaseManager(
     configuration_manager=configuration_manager,
@@ -45,10 +62,48 @@ data_processor = DataProcessor(
     configuration_manager=configuration_manager,
     data_directory=Path(configuration_manager.get_value("persistent-volume.data_directory")),
     langchain_vector_store=langchain_vector_store,
+    database_engine=database_manager.create_engine(),
     chunk_size=3000,
     chunk_overlap=300,
 )
 
+job_manager = IngestionJobManager(
+    logger=logger,
+    database_engine=database_manager.create_engine(),
+    jobs={
+        "upload_data_from_folder": data_processor.upload_data_from_folder,
+        "synchronize_data_directory": data_processor.synchronize_data_directory,
+    },
+    checkpoint_interval=float(configuration_manager.get_value("ingestion_job_manager.checkpoint_interval")),
+)
+
+data_directory_watcher = None
+if configuration_manager.get_value("data_directory_watcher.enabled").lower() == "true":
+    data_directory_watcher = DataDirectoryWatcher(
+        logger=logger,
+        directory=configuration_manager.get_value("persistent-volume.data_directory"),
+        synchronize=lambda file_paths: data_processor.synchronize_data_directory(file_paths=file_paths),
+        debounce=float(configuration_manager.get_value("data_directory_watcher.debounce")),
+        max_delay=float(configuration_manager.get_value("data_directory_watcher.max_delay")),
+        reconcile_interval=float(configuration_manager.get_value("data_directory_watcher.reconcile_interval")),
+    )
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # resumes a job the previous pod left unfinished
+    await job_manager.start()
+    if data_directory_watcher is not None:
+        await data_directory_watcher.start()
+    yield
+    if data_directory_watcher is not None:
+        await data_directory_watcher.stop()
+    await job_manager.stop()
+    data_processor.close()
+
+
+app = FastAPI(title="Data Processor", lifespan=lifespan)
+
 
 @app.get("/")
 async def redirect_root():
@@ -56,26 +111,51 @@ async def redirect_root():
 
 @app.get("/status")
 async def read_root() -> dict:
-    return {"message": "Data processor is running"}
+    return {
+        "message": "Data processor is running",
+        "embeddings_connection_pool": embeddings.get_pool_statistics(),
+        "embeddings_endpoints": embeddings.get_endpoint_statistics(),
+        "data_directory_watcher": data_directory_watcher.get_statistics() if data_directory_watcher else None,
+    }
+
+
+async def start_job(kind: str) -> dict:
+    try:
+        return await job_manager.start_job(kind)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 
 @app.get("/synchronize-data-directory")
 async def synchronize_data_directory() -> dict:
-    await data_processor.synchronize_data_directory()
-    # return {"message": "Synchronization started in the background."}
-    return {"message": "Synchronization not implemented yet"}
-
-def get_data_processor() -> DataProcessor:
-    return data_processor
+    return await start_job("synchronize_data_directory")
 
 @app.get("/upload_data_from_folder")
-async def upload_data_from_folder(data_processor: DataProcessor = Depends(get_data_processor)) -> list:
-    try:
-        result = await data_processor.upload_data_from_folder()
-        return result
-    except Exception as e:
-        logger.error(f"Failed to upload data from folder: {e}")
-        return {"error": "Failed to upload data from folder."}
+async def upload_data_from_folder() -> dict:
+    # runs in the background, progress is reported by /jobs/{job_id}
+    return await start_job("upload_data_from_folder")
+
+
+@app.get("/jobs")
+async def read_jobs() -> list:
+    # summaries without results, /jobs/{job_id} returns a job's result
+    return await job_manager.list_jobs()
+
+
+@app.get("/jobs/{job_id}")
+async def read_job(job_id: str) -> dict:
+    job = await job_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str) -> dict:
+    job = job_manager.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} is not running.")
+    return job
 
 
 # for debugging only
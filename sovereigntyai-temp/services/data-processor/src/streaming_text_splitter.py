@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import codecs
+from typing import TYPE_CHECKING, Iterator
+
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+class StreamingTextSplitter:
+    # splits a file a window at a time into the chunks split_text gives for the whole file, so memory follows the
+    # window and not the file. The splitter splits a text at the first of its separators the text contains, merges
+    # the pieces into chunks, and splits a piece of a chunk's size or more again with the separators after that one.
+    # The file is therefore scanned for its separator first, and the pieces are merged here the way the splitter
+    # merges them, which tells the piece each chunk starts with: merging again from that piece gives the same
+    # chunks, so the text is cut there. The last chunks of a window may end at the window's edge, they are held
+    # back and split again with the next window. A piece longer than a window is continued with its own separator,
+    # read ahead from the file if the window does not tell which one it is, and kept as a stack of levels
+
+    HELD_BACK_CHUNKS = 2
+
+    def __init__(
+            self,
+            text_splitter: RecursiveCharacterTextSplitter,
+            chunk_size: int,
+            chunk_overlap: int,
+            window_size: int,
+    ) -> None:
+        if window_size < 4 * chunk_size:
+            raise ValueError(f"The streaming window ({window_size}) must hold at least 4 chunks of {chunk_size}.")
+        # the pieces are found here without regular expressions, with the separator kept at the start of each
+        if text_splitter._is_separator_regex or text_splitter._keep_separator not in (True, "start"):
+            raise ValueError("The streaming splitter needs plain separators kept at the start of the pieces.")
+        self._text_splitter = text_splitter
+        self._separators = text_splitter._separators
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._window_size = window_size
+
+    def _read_windows(self, file: str, offset: int = 0) -> Iterator[tuple[str, int]]:
+        # the same decoding and newline handling as reading the file whole, with the offset in the file each
+        # window ends at
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        pending = ""
+        with open(file, "rb") as f:
+            f.seek(offset)
+            while block := f.read(self._window_size):
+                text = pending + decoder.decode(block)
+                # a "\r\n" split between two blocks stays one newline
+                text, pending = (text[:-1], "\r") if text.endswith("\r") else (text, "")
+                yield (
+                    text.replace("\r\n", "\n").replace("\r", "\n"),
+                    f.tell() - len(decoder.getstate()[0]) - len(pending),
+                )
+            text = pending + decoder.decode(b"", final=True)
+            if text:
+                yield text.replace("\r\n", "\n").replace("\r", "\n"), f.tell()
+
+    def _select_separator(self, text: str, first: int) -> int:
+        # the index of the separator the splitter picks for text out of the separators from first on
+        for index in range(first, len(self._separators)):
+            if self._separators[index] == "" or self._separators[index] in text:
+                return index
+        return len(self._separators) - 1
+
+    def _read_separator(self, file: str, offset: int, text: str, first: int, ends: list[str]) -> int:
+        # the separator the splitter picks for a piece that starts with text, out of the separators from first on:
+        # the rest of the piece is read from the file at offset, up to the first of the separators it ends at
+        found = self._select_separator(text, first)
+        longest = max(len(separator) for separator in self._separators)
+        # a separator may straddle two windows
+        tail = text[len(text) - longest + 1:]
+        for window, _ in self._read_windows(file, offset):
+            window = tail + window
+            end = min((position for separator in ends if (position := window.find(separator)) >= 0), default=None)
+            found = min(found, self._select_separator(window[:end], first))
+            if found == first or end is not None:
+                break
+            tail = window[len(window) - longest + 1:]
+        return found
+
+    def _find_separators(self, text: str, separator: str) -> list[int]:
+        # where the splitter splits text at separator, it matches them from the left
+        if separator == "":
+            return list(range(len(text)))
+        positions = []
+        position = 0
+        while (position := text.find(separator, position)) >= 0:
+            positions.append(position)
+            position += len(separator)
+        return positions
+
+    def _segments(self, text: str, levels: list[tuple[int, int]]) -> list[tuple[int, int, int]]:
+        # levels are (separator index, position to look for the separator of the level above from): the text starts
+        # inside a piece of every level but the last one, which ends at that level's next separator or where the
+        # piece it is part of ends
+        ends = [len(text)]
+        for depth in range(1, len(levels)):
+            end = text.find(self._separators[levels[depth - 1][0]], levels[depth][1])
+            ends.append(ends[-1] if end < 0 else min(ends[-1], end))
+        ends.append(0)
+        return [
+            (ends[depth + 1], ends[depth], depth)
+            for depth in range(len(levels) - 1, -1, -1)
+            if ends[depth + 1] < ends[depth]
+        ]
+
+    def _merge(self, pieces: list[tuple[int, str]]) -> list[tuple[str, int]]:
+        # RecursiveCharacterTextSplitter._merge_splits, keeping where the first piece of each chunk starts
+        length = self._text_splitter._length_function
+        chunks = []
+        merged: list[tuple[int, str]] = []
+        total = 0
+        for start, piece in pieces:
+            piece_length = length(piece)
+            if total + piece_length > self._chunk_size and merged:
+                chunk = self._text_splitter._join_docs([merged_piece for _, merged_piece in merged], "")
+                if chunk is not None:
+                    chunks.append((chunk, merged[0][0]))
+                while total > self._chunk_overlap or (total + piece_length > self._chunk_size and total > 0):
+                    total -= length(merged.pop(0)[1])
+            merged.append((start, piece))
+            total += piece_length
+        chunk = self._text_splitter._join_docs([merged_piece for _, merged_piece in merged], "")
+        if chunk is not None:
+            chunks.append((chunk, merged[0][0]))
+        return chunks
+
+    def _split_segment(self, text: str, index: int) -> list[tuple[str, int | None]]:
+        # RecursiveCharacterTextSplitter._split_text with the separators from index on, with where in text each
+        # chunk can be cut in front of
+        if self._select_separator(text, index) != index:
+            # text without the separator of its level is a part of a single piece, its chunks are not cut apart
+            return [(chunk, None) for chunk in self._text_splitter._split_text(text, self._separators[index:])]
+
+        separator = self._separators[index]
+        deeper = self._separators[index + 1:] if separator and separator in text else []
+        bounds = sorted({0, *self._find_separators(text, separator), len(text)})
+        chunks: list[tuple[str, int | None]] = []
+        pieces = []
+        for start, end in zip(bounds, bounds[1:]):
+            piece = text[start:end]
+            if self._text_splitter._length_function(piece) < self._chunk_size:
+                pieces.append((start, piece))
+                continue
+            chunks.extend(self._merge(pieces))
+            pieces = []
+            # the chunks of a long piece are cut apart one level down
+            piece_chunks = self._text_splitter._split_text(piece, deeper) if deeper else [piece]
+            chunks.extend(zip(piece_chunks, [start] + [None] * (len(piece_chunks) - 1)))
+        chunks.extend(self._merge(pieces))
+        return chunks
+
+    def _split(self, text: str, levels: list[tuple[int, int]]) -> tuple[list[str], list[tuple[int, int] | None]]:
+        # the chunks of text, and the position and level of the cut in front of each chunk where there is one
+        chunks = []
+        cuts = []
+        for start, end, depth in self._segments(text, levels):
+            for chunk, cut in self._split_segment(text[start:end], levels[depth][0]):
+                chunks.append(chunk)
+                cuts.append(None if cut is None else (start + cut, depth))
+        return chunks, cuts
+
+    def _descend(
+            self,
+            text: str,
+            levels: list[tuple[int, int]],
+            file: str,
+            offset: int,
+    ) -> tuple[int, list[tuple[int, int]]] | None:
+        # text that is a single piece of a chunk's size or more, after pieces of whitespace that make no chunks, is
+        # split with the separators after its level's: the ones the splitter uses for the whole piece
+        segments = self._segments(text, levels)
+        if len(segments) != 1:
+            return None
+        depth = segments[0][2]
+        separator = self._separators[levels[depth][0]]
+        if separator == "" or levels[depth][0] + 1 == len(self._separators):
+            return None
+        positions = self._find_separators(text, separator)
+        start = positions[-1] if positions else 0
+        if text[:start].strip() or len(text) - start < self._chunk_size:
+            return None
+
+        ends = [self._separators[index] for index, _ in levels[:depth + 1]]
+        found = self._read_separator(file, offset, text[start:], levels[depth][0] + 1, ends)
+        cut_levels = [(index, max(0, search_from - start)) for index, search_from in levels[:depth + 1]]
+        # the piece ends at the next separator of its level after its own
+        return start, [*cut_levels, (found, len(separator) if positions else 0)]
+
+    def _find_cut(
+            self,
+            cuts: list[tuple[int, int] | None],
+            levels: list[tuple[int, int]],
+    ) -> tuple[int, int, list[tuple[int, int]]] | None:
+        # the last chunk in front of the held back ones the text can be cut in front of
+        for position in range(len(cuts) - self.HELD_BACK_CHUNKS, 0, -1):
+            if cuts[position] is not None and cuts[position][0] > 0:
+                cut, depth = cuts[position]
+                return position, cut, [(index, max(0, search_from - cut)) for index, search_from in levels[:depth + 1]]
+        return None
+
+    def _find_file_separator(self, file: str) -> int:
+        # the separator split_text splits the whole file at, the file is read once more unless it is the first one
+        return self._read_separator(file, 0, "", 0, [])
+
+    def split_file(self, file: str) -> Iterator[str]:
+        levels = [(self._find_file_separator(file), 0)]
+        text = ""
+        for window, offset in self._read_windows(file):
+            text += window
+            chunks, cuts = self._split(text, levels)
+            cut = self._find_cut(cuts, levels)
+            if cut is None and (descended := self._descend(text, levels, file, offset)) is not None:
+                start, levels = descended
+                text = text[start:]
+                chunks, cuts = self._split(text, levels)
+                cut = self._find_cut(cuts, levels)
+            if cut is None:
+                continue
+
+            position, start, levels = cut
+            yield from chunks[:position]
+            text = text[start:]
+
+        if text:
+            yield from self._split(text, levels)[0]
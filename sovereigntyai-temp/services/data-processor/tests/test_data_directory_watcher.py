@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import shutil
+import time
+
+from data_directory_watcher import DataDirectoryWatcher
+
+
+def watch(directory, changes, fail_first=False):
+    # runs changes(wait_for_calls) while the directory is watched, returns the paths of every synchronization
+    calls = []
+
+    async def synchronize(file_paths):
+        calls.append(file_paths)
+        if fail_first and len(calls) == 2:
+            raise RuntimeError("database is down")
+        return {"files": len(file_paths or ())}
+
+    async def wait_for_calls(count):
+        deadline = time.monotonic() + 5
+        while len(calls) < count:
+            assert time.monotonic() < deadline, calls
+            await asyncio.sleep(0.01)
+
+    async def run():
+        watcher = DataDirectoryWatcher(
+            logger=logging.getLogger(__name__),
+            directory=str(directory),
+            synchronize=synchronize,
+            debounce=0.1,
+            max_delay=1.0,
+            reconcile_interval=60.0,
+        )
+        await watcher.start()
+        try:
+            await wait_for_calls(1)
+            await changes(wait_for_calls)
+            # nothing else follows once the directory is quiet
+            await asyncio.sleep(0.3)
+            return calls, watcher.get_statistics()
+        finally:
+            await watcher.stop()
+
+    return asyncio.run(run())
+
+
+def test_a_burst_of_changes_is_synchronized_once_after_the_start_reconcile(tmp_path):
+    async def changes(wait_for_calls):
+        (tmp_path / "a.txt").write_text("a")
+        (tmp_path / "b.txt").write_text("b")
+        (tmp_path / "a.txt").write_text("a again")
+        (tmp_path / "ignored.pdf").write_text("not text")
+        await wait_for_calls(2)
+
+    calls, statistics = watch(tmp_path, changes)
+
+    assert calls == [None, {"a.txt", "b.txt"}]
+    assert statistics["reconciles"] == 1
+    assert statistics["synchronizations"] == 1
+    assert statistics["pending"] == 0
+
+
+def test_a_removed_directory_triggers_a_reconcile(tmp_path):
+    (tmp_path / "directory").mkdir()
+
+    async def changes(wait_for_calls):
+        (tmp_path / "directory" / "a.txt").write_text("a")
+        await wait_for_calls(2)
+        shutil.rmtree(tmp_path / "directory")
+        await wait_for_calls(3)
+
+    calls, _ = watch(tmp_path, changes)
+
+    assert calls == [None, {"directory/a.txt"}, None]
+
+
+def test_the_paths_of_a_failed_synchronization_are_retried(tmp_path):
+    async def changes(wait_for_calls):
+        (tmp_path / "a.txt").write_text("a")
+        await wait_for_calls(2)
+        (tmp_path / "b.txt").write_text("b")
+        await wait_for_calls(3)
+
+    calls, statistics = watch(tmp_path, changes, fail_first=True)
+
+    assert calls == [None, {"a.txt"}, {"a.txt", "b.txt"}]
+    assert statistics["failures"] == 1
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_postgres.vectorstores import PGVector
+from sqlalchemy import create_engine, text
+
+from data_processor import DataProcessor
+
+COLLECTION_NAME = "documents"
+
+
+class Configuration:
+    VALUES = {
+        "language_identifier.sample_size": 2000,
+        "language_identifier.seed": 0,
+        "ingestion_engine.parse_workers": 1,
+        "ingestion_engine.embedding_workers": 1,
+        "ingestion_engine.insert_workers": 1,
+        "ingestion_engine.queue_size": 1,
+        "ingestion_engine.embedding_batch_size": 1,
+        "ingestion_engine.insert_batch_size": 1,
+        "ingestion_engine.streaming_threshold": 67108864,
+        "ingestion_engine.streaming_window": 65536,
+    }
+
+    def __init__(self, data_directory):
+        self._values = {**self.VALUES, "persistent-volume.data_directory": str(data_directory)}
+
+    def get_value(self, key):
+        return self._values[key]
+
+    def get_values(self, key):
+        return []
+
+
+@pytest.fixture
+def data_processor(database_url, tmp_path):
+    vector_store = PGVector(
+        embeddings=DeterministicFakeEmbedding(size=8),
+        connection=database_url,
+        collection_name=COLLECTION_NAME,
+        use_jsonb=True,
+    )
+    database_engine = create_engine(database_url)
+    data_processor = DataProcessor(
+        logger=logging.getLogger(__name__),
+        secret_manager=None,
+        configuration_manager=Configuration(tmp_path),
+        data_directory=tmp_path,
+        langchain_vector_store=vector_store,
+        database_engine=database_engine,
+        chunk_size=3000,
+        chunk_overlap=300,
+    )
+    data_processor._create_tables()
+    yield data_processor
+    data_processor.close()
+    database_engine.dispose()
+    vector_store._engine.dispose()
+
+
+def store_file(data_processor, file_path, chunks):
+    # what the ingestion does for a file: the vectors not stored yet are added naming the file, then the file's
+    # row replaces its chunk references; the chunks it referenced before are returned
+    vector_store = data_processor._LANGCHAIN_VECTOR_STORE
+    stored = set(stored_vectors(data_processor))
+    new_chunks = {chunk_id: chunk for chunk_id, chunk in chunks.items() if chunk_id not in stored}
+    if new_chunks:
+        vector_store.add_texts(
+            list(new_chunks.values()),
+            metadatas=[{"file_path": file_path, "file_name": file_path} for _ in new_chunks],
+            ids=list(new_chunks),
+        )
+    return data_processor._upsert_files([{
+        "file_path": file_path,
+        "file_name": file_path,
+        "file_hash": f"hash of {file_path} with {sorted(chunks)}",
+        "language": "en",
+        "source_file_name": file_path,
+        "file_size": 1,
+        "file_mtime_ns": 1,
+        "chunk_ids": list(chunks),
+    }])
+
+
+def stored_vectors(data_processor):
+    # chunk id -> the file path its metadata names
+    with data_processor._DATABASE_ENGINE.connect() as connection:
+        return dict(connection.execute(text(
+            "SELECT e.id, e.cmetadata ->> 'file_path' FROM langchain_pg_embedding AS e "
+            "JOIN langchain_pg_collection AS c ON c.uuid = e.collection_id WHERE c.name = :name"
+        ), {"name": COLLECTION_NAME}).all())
+
+
+def chunk_references(data_processor):
+    with data_processor._DATABASE_ENGINE.connect() as connection:
+        return set(connection.execute(text("SELECT file_path, chunk_id FROM file_chunks")).all())
+
+
+def test_deleting_a_file_keeps_the_chunks_another_file_shares(data_processor):
+    store_file(data_processor, "a.txt", {"shared": "shared text", "only-a": "text of a"})
+    store_file(data_processor, "b.txt", {"shared": "shared text", "only-b": "text of b"})
+
+    released = data_processor._delete_files(["a.txt"])
+    data_processor._release_chunks(sorted(set(released)), ["a.txt"])
+
+    # the shared vector named a.txt, which added it first; it now names the file still containing it
+    assert stored_vectors(data_processor) == {"shared": "b.txt", "only-b": "b.txt"}
+    assert chunk_references(data_processor) == {("b.txt", "shared"), ("b.txt", "only-b")}
+
+
+def test_modifying_a_file_deletes_the_chunk_it_no_longer_contains(data_processor):
+    store_file(data_processor, "a.txt", {"kept": "kept text", "removed": "removed text"})
+    store_file(data_processor, "b.txt", {"other": "text of b"})
+
+    released = store_file(data_processor, "a.txt", {"kept": "kept text", "added": "added text"})
+    data_processor._release_chunks(sorted(set(released)), ["a.txt"])
+
+    assert stored_vectors(data_processor) == {"kept": "a.txt", "added": "a.txt", "other": "b.txt"}
+    assert chunk_references(data_processor) == {("a.txt", "kept"), ("a.txt", "added"), ("b.txt", "other")}
+
+
+def test_release_keeps_a_chunk_that_moved_to_another_file(data_processor):
+    # a renamed file: the new path is ingested before the old one's vectors are released
+    store_file(data_processor, "old.txt", {"moved": "moved text"})
+    store_file(data_processor, "new.txt", {"moved": "moved text"})
+
+    released = data_processor._delete_files(["old.txt"])
+    data_processor._release_chunks(sorted(set(released)), ["old.txt", "new.txt"])
+
+    assert stored_vectors(data_processor) == {"moved": "new.txt"}
+    assert chunk_references(data_processor) == {("new.txt", "moved")}
+
+
+def test_release_deletes_a_released_chunk_whose_vector_names_another_file(data_processor):
+    store_file(data_processor, "a.txt", {"chunk": "chunk text"})
+    # the vector names a file outside the run, e.g. one renamed while the service was down
+    store_file(data_processor, "b.txt", {"chunk": "chunk text"})
+    data_processor._delete_files(["a.txt"])
+
+    released = data_processor._delete_files(["b.txt"])
+    data_processor._release_chunks(sorted(set(released)), ["b.txt"])
+
+    assert stored_vectors(data_processor) == {}
+
+
+def test_release_deletes_vectors_of_a_changed_file_that_no_file_references(data_processor):
+    # vectors stored before chunks were content addressed have no chunk references
+    data_processor._LANGCHAIN_VECTOR_STORE.add_texts(
+        ["old chunk"], metadatas=[{"file_path": "a.txt", "file_name": "a.txt"}], ids=["random-id"],
+    )
+
+    released = store_file(data_processor, "a.txt", {"chunk": "chunk text"})
+    data_processor._release_chunks(sorted(set(released)), ["a.txt"])
+
+    assert released == []
+    assert stored_vectors(data_processor) == {"chunk": "a.txt"}
+
+
+def test_migration_ingests_the_files_stored_before_content_addressing_again(data_processor, tmp_path):
+    # the database as it was before: vectors with random ids, some without metadata, and no chunk references
+    vector_store = data_processor._LANGCHAIN_VECTOR_STORE
+    vector_store.add_texts(["text without metadata"], ids=["without-metadata"])
+    vector_store.add_texts(
+        ["old text of a", "old text of gone"],
+        metadatas=[{"file_path": "a.txt", "file_name": "a.txt"}, {"file_path": "gone.txt", "file_name": "gone.txt"}],
+        ids=["old-a", "old-gone"],
+    )
+    (tmp_path / "a.txt").write_text("text of a")
+    stat = (tmp_path / "a.txt").stat()
+    with data_processor._DATABASE_ENGINE.begin() as connection:
+        connection.execute(text("DROP TABLE file_chunks"))
+        connection.execute(data_processor._FILES_METADATA_TABLE.insert(), [
+            {"file_path": "a.txt", "file_name": "a.txt", "file_hash": "old hash of a", "language": "en",
+             "file_size": stat.st_size, "file_mtime_ns": stat.st_mtime_ns},
+            {"file_path": "gone.txt", "file_name": "gone.txt", "file_hash": "old hash of gone", "language": "en",
+             "file_size": 1, "file_mtime_ns": 1},
+        ])
+
+    result = asyncio.run(data_processor.synchronize_data_directory())
+
+    vectors = stored_vectors(data_processor)
+    assert result["ingested"] == 1
+    assert result["removed"] == 1
+    assert set(vectors.values()) == {"a.txt"}
+    assert not {"without-metadata", "old-a", "old-gone"} & set(vectors)
+    assert chunk_references(data_processor) == {("a.txt", chunk_id) for chunk_id in vectors}
+
+
+def test_synchronization_ingests_only_the_files_whose_content_changed(data_processor, tmp_path):
+    (tmp_path / "a.txt").write_text("text of a")
+    (tmp_path / "b.txt").write_text("text of b")
+    (tmp_path / "c.txt").write_text("text of c")
+    first = asyncio.run(data_processor.synchronize_data_directory())
+
+    # b is rewritten with the same text, so only its stat changes; c gets new text
+    (tmp_path / "b.txt").write_text("text of b")
+    os.utime(tmp_path / "b.txt", ns=(1, 1))
+    (tmp_path / "c.txt").write_text("new text of c")
+    second = asyncio.run(data_processor.synchronize_data_directory())
+    third = asyncio.run(data_processor.synchronize_data_directory())
+
+    assert (first["ingested"], first["unchanged"]) == (3, 0)
+    assert (second["unchanged"], second["touched"], second["ingested"]) == (1, 1, 1)
+    assert (third["unchanged"], third["touched"], third["ingested"]) == (3, 0, 0)
+    assert sorted(stored_vectors(data_processor).values()) == ["a.txt", "b.txt", "c.txt"]
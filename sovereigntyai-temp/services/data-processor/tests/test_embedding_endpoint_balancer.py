@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from modules.embedding_endpoint_balancer import EmbeddingEndpointBalancer
+
+URLS = ["http://embeddings-1:8000", "http://embeddings-2:8000"]
+
+
+def create_balancer(urls=URLS, health_check_interval=0.0, ejection_time=30.0):
+    return EmbeddingEndpointBalancer(
+        logger=logging.getLogger(__name__),
+        urls=urls,
+        health_check_interval=health_check_interval,
+        health_check_timeout=1.0,
+        failure_threshold=2,
+        ejection_time=ejection_time,
+    )
+
+
+def send(balancer, failed_urls=()):
+    # one request: the endpoint it went to, released as failed when it is one of failed_urls
+    url = balancer.acquire()
+    balancer.release(url, failed=url in failed_urls)
+    return url
+
+
+def test_acquire_spreads_requests_over_the_endpoints():
+    balancer = create_balancer()
+
+    assert sorted(send(balancer) for _ in range(4)) == sorted(URLS * 2)
+
+
+def test_acquire_prefers_the_endpoint_with_fewer_outstanding_requests():
+    balancer = create_balancer()
+
+    busy = balancer.acquire()
+
+    assert balancer.acquire() != busy
+
+
+def test_an_endpoint_is_ejected_after_consecutive_failures_and_restored_after_the_ejection_time():
+    balancer = create_balancer(ejection_time=0.2)
+    failing = URLS[0]
+
+    while balancer.get_statistics()[failing]["consecutive_failures"] < 2:
+        send(balancer, failed_urls=[failing])
+
+    assert not balancer.get_statistics()[failing]["healthy"]
+    assert {send(balancer) for _ in range(4)} == {URLS[1]}
+
+    time.sleep(0.25)
+
+    assert balancer.get_statistics()[failing]["healthy"]
+    assert {send(balancer) for _ in range(4)} == set(URLS)
+
+
+def test_a_success_resets_the_consecutive_failures():
+    balancer = create_balancer()
+
+    for failed in (True, False, True):
+        balancer.release(balancer.acquire(exclude=[URLS[1]]), failed=failed)
+
+    assert balancer.get_statistics()[URLS[0]]["healthy"]
+    assert balancer.get_statistics()[URLS[0]]["failures"] == 2
+
+
+def test_a_single_endpoint_is_never_ejected():
+    balancer = create_balancer(urls=URLS[:1])
+
+    for _ in range(5):
+        send(balancer, failed_urls=URLS)
+
+    assert balancer.get_statistics()[URLS[0]]["healthy"]
+
+
+def test_acquire_falls_back_to_an_ejected_endpoint_when_every_one_is_ejected():
+    balancer = create_balancer()
+
+    for _ in range(4):
+        send(balancer, failed_urls=URLS)
+
+    assert not any(endpoint["healthy"] for endpoint in balancer.get_statistics().values())
+    assert send(balancer) in URLS
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = json.dumps({"startup": {"state": self.server.state}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def status_servers():
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler) for _ in range(2)]
+    for server in servers:
+        server.state = "ready"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_health_checks_eject_a_loading_replica_and_restore_it_once_it_is_ready(status_servers):
+    urls = [f"http://127.0.0.1:{server.server_address[1]}" for server in status_servers]
+    status_servers[0].state = "loading"
+    # ejected for longer than the test runs, only a passing health check brings it back
+    balancer = create_balancer(urls=urls, health_check_interval=0.02, ejection_time=60.0)
+    try:
+        wait_for(lambda: not balancer.get_statistics()[urls[0]]["healthy"])
+        assert balancer.get_statistics()[urls[0]]["last_health_check"] == "model is loading"
+        assert {send(balancer) for _ in range(4)} == {urls[1]}
+
+        status_servers[0].state = "ready"
+
+        wait_for(lambda: balancer.get_statistics()[urls[0]]["healthy"])
+        assert {send(balancer) for _ in range(4)} == set(urls)
+    finally:
+        balancer.close()
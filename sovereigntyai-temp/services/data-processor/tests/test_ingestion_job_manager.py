@@ -0,0 +1,126 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import create_engine
+
+from ingestion_job_manager import IngestionJobManager
+
+
+class Logger(logging.LoggerAdapter):
+    # the FileLogger calls the job manager makes
+
+    def __init__(self):
+        super().__init__(logging.getLogger(__name__))
+        self.job_ids = []
+
+    def set_job_id(self, job_id):
+        self.job_ids.append(job_id)
+
+
+class Job:
+    # an ingestion job that counts its files and waits for release before it finishes
+
+    def __init__(self):
+        self.runs = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, progress):
+        self.runs += 1
+        progress["files_completed"] = self.runs
+        await self.release.wait()
+        return {"ingested": self.runs}
+
+
+@pytest.fixture
+def database_engine(database_url):
+    database_engine = create_engine(database_url)
+    yield database_engine
+    database_engine.dispose()
+
+
+def create_manager(database_engine, job):
+    return IngestionJobManager(
+        logger=Logger(),
+        database_engine=database_engine,
+        jobs={"synchronize_data_directory": job},
+        checkpoint_interval=0.01,
+    )
+
+
+async def wait_for_state(manager, job_id, state):
+    for _ in range(500):
+        job = await manager.get_job(job_id)
+        if job["state"] == state:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {job['state']}, not {state}")
+
+
+def test_a_job_runs_in_the_background_and_its_result_is_stored(database_engine):
+    async def run():
+        job = Job()
+        manager = create_manager(database_engine, job)
+        await manager.start()
+        started = await manager.start_job("synchronize_data_directory")
+        running = await wait_for_state(manager, started["job_id"], "running")
+        with pytest.raises(RuntimeError, match="still running"):
+            await manager.start_job("synchronize_data_directory")
+
+        job.release.set()
+        await wait_for_state(manager, started["job_id"], "completed")
+        # another process reads the job from the table
+        stored = await create_manager(database_engine, Job()).get_job(started["job_id"])
+        return running, stored, await manager.list_jobs()
+
+    running, stored, jobs = asyncio.run(run())
+
+    assert running["progress"] == {"files_completed": 1}
+    assert stored["state"] == "completed"
+    assert stored["result"] == {"ingested": 1}
+    assert stored["finished_at"] is not None
+    assert [(job["job_id"], job["state"]) for job in jobs] == [(stored["job_id"], "completed")]
+    assert "result" not in jobs[0]
+
+
+def test_a_job_interrupted_by_a_stop_is_resumed_on_the_next_start(database_engine):
+    async def run():
+        manager = create_manager(database_engine, Job())
+        await manager.start()
+        started = await manager.start_job("synchronize_data_directory")
+        await wait_for_state(manager, started["job_id"], "running")
+        await manager.stop()
+        interrupted = await manager.get_job(started["job_id"])
+
+        job = Job()
+        job.release.set()
+        resumed = create_manager(database_engine, job)
+        await resumed.start()
+        completed = await wait_for_state(resumed, started["job_id"], "completed")
+        return interrupted, completed
+
+    interrupted, completed = asyncio.run(run())
+
+    assert interrupted["state"] == "interrupted"
+    assert interrupted["finished_at"] is None
+    assert completed["attempts"] == 2
+
+
+def test_a_cancelled_job_is_not_resumed(database_engine):
+    async def run():
+        manager = create_manager(database_engine, Job())
+        await manager.start()
+        started = await manager.start_job("synchronize_data_directory")
+        await wait_for_state(manager, started["job_id"], "running")
+        assert manager.cancel_job("unknown") is None
+        manager.cancel_job(started["job_id"])
+        cancelled = await wait_for_state(manager, started["job_id"], "cancelled")
+
+        job = Job()
+        await create_manager(database_engine, job).start()
+        return cancelled, job.runs
+
+    cancelled, runs = asyncio.run(run())
+
+    assert cancelled["finished_at"] is not None
+    assert runs == 0
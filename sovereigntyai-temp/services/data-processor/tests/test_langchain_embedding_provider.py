@@ -0,0 +1,225 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from modules.embedding_wire_format import EmbeddingWireFormat
+from modules.langchain_embedding_provider import LangchainEmbeddingProvider
+
+DIMENSIONS = 12
+URLS = ["http://embeddings-1:8000", "http://embeddings-2:8000"]
+
+
+class Configuration:
+    VALUES = {
+        "langchain_embedding_provider.wire_format": "json",
+        "langchain_embedding_provider.normalize": "false",
+        "langchain_embedding_provider.quantization": "none",
+        "langchain_embedding_provider.stream_window_size": "4",
+        "langchain_embedding_provider.pool_size": "2",
+        "langchain_embedding_provider.connect_timeout": "1",
+        "langchain_embedding_provider.read_timeout": "1",
+        "langchain_embedding_provider.max_retries": "0",
+        "langchain_embedding_provider.retry_backoff_factor": "0",
+        "langchain_embedding_provider.max_batch_size": "2",
+        "langchain_embedding_provider.max_batch_bytes": "1048576",
+        "langchain_embedding_provider.max_in_flight": "3",
+        # no background health checks, the tests drive the balancer themselves
+        "embedding_endpoint_balancer.health_check_interval": "0",
+        "embedding_endpoint_balancer.health_check_timeout": "1",
+        "embedding_endpoint_balancer.failure_threshold": "2",
+        "embedding_endpoint_balancer.ejection_time": "30",
+    }
+
+    def __init__(self, urls):
+        self._urls = urls
+
+    def get_value(self, key):
+        return self.VALUES[key]
+
+    def get_values(self, key):
+        return self._urls
+
+
+class EmbeddingsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        # the JSON answer of /embed_documents, every component of a row is the number its text ends with
+        texts = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["texts"]
+        numbers = [int(text.split()[-1]) for text in texts]
+        self.server.batches.append(numbers)
+        # the first sub-batches answer last, so they complete out of order
+        time.sleep(max(0.0, 0.1 - 0.02 * numbers[0]))
+        body = json.dumps({
+            "embeddings": [[number] * DIMENSIONS for number in numbers],
+            "quantization": "none",
+            "dimensions": DIMENSIONS,
+        }).encode("utf-8") if self.server.status == 200 else b""
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EmbeddingsServer(ThreadingHTTPServer):
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), EmbeddingsHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.status = 200
+        self.batches = []
+
+
+@pytest.fixture
+def servers():
+    servers = [EmbeddingsServer() for _ in range(2)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def create_provider():
+    providers = []
+
+    def create(urls):
+        provider = LangchainEmbeddingProvider(
+            logger=logging.getLogger(__name__),
+            secret_manager=None,
+            configuration_manager=Configuration(urls),
+        )
+        providers.append(provider)
+        return provider
+
+    yield create
+    for provider in providers:
+        provider._fan_out_executor.shutdown(wait=True)
+        provider._session.close()
+
+
+@pytest.fixture
+def provider(create_provider):
+    return create_provider(URLS)
+
+
+def create_json_body(embeddings, quantization, json_key):
+    # what the embeddings service answers on its JSON path
+    body = {"quantization": quantization, "dimensions": embeddings.shape[1], "scales": None, "scale": None}
+    match quantization:
+        case "float16":
+            values = embeddings.astype(np.float16).tolist()
+        case "int8":
+            values, scales = EmbeddingWireFormat.quantize_int8(embeddings)
+            values = values.tolist()
+            body["scales" if json_key == "embeddings" else "scale"] = (
+                scales.tolist() if json_key == "embeddings" else float(scales[0])
+            )
+        case "binary":
+            values = EmbeddingWireFormat.pack_binary(embeddings).tolist()
+        case _:
+            values = embeddings.tolist()
+    body[json_key] = values if json_key == "embeddings" else values[0]
+    return body
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_decode_json_returns_an_empty_matrix_without_embeddings(quantization):
+    body = create_json_body(np.empty((0, DIMENSIONS), dtype=np.float32), quantization, "embeddings")
+
+    embeddings = LangchainEmbeddingProvider._decode_json(body, "embeddings")
+
+    assert embeddings.shape == (0, DIMENSIONS)
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+@pytest.mark.parametrize(("json_key", "rows"), [("embeddings", 3), ("embedding", 1)])
+def test_decode_json_returns_one_row_per_embedding(quantization, json_key, rows):
+    expected = EmbeddingWireFormat.normalize(
+        np.random.default_rng(0).standard_normal((rows, DIMENSIONS)).astype(np.float32)
+    )
+
+    embeddings = LangchainEmbeddingProvider._decode_json(create_json_body(expected, quantization, json_key), json_key)
+
+    assert embeddings.shape == (rows, DIMENSIONS)
+    match quantization:
+        case "binary":
+            assert (np.sign(embeddings) == np.sign(expected)).all()
+        case _:
+            np.testing.assert_allclose(embeddings, expected, atol=1 / 127)
+
+
+def test_async_client_belongs_to_the_loop_that_created_it(provider):
+    async def get_client():
+        return provider._get_async_client()
+
+    async def get_client_and_close():
+        client = provider._get_async_client()
+        await provider.aclose()
+        return client
+
+    first = asyncio.run(get_client_and_close())
+    assert first.is_closed
+
+    second = asyncio.run(get_client())
+    # without aclose on its loop, another loop is refused instead of replacing the client and leaking its pool
+    with pytest.raises(RuntimeError, match="another event loop"):
+        asyncio.run(get_client())
+    assert second is not first
+    assert not second.is_closed
+
+
+def test_embed_documents_returns_the_fanned_out_rows_in_input_order(servers, create_provider):
+    provider = create_provider([servers[0].url])
+    texts = [f"text {number}" for number in range(9)]
+
+    embeddings = provider.embed_documents_as_array(texts)
+
+    # five sub-batches of at most two texts, three of them in flight at a time
+    assert sorted(servers[0].batches) == [[0, 1], [2, 3], [4, 5], [6, 7], [8]]
+    assert embeddings.shape == (len(texts), DIMENSIONS)
+    assert embeddings[:, 0].tolist() == list(range(len(texts)))
+
+
+def test_aembed_documents_returns_the_fanned_out_rows_in_input_order(servers, create_provider):
+    provider = create_provider([servers[0].url])
+    texts = [f"text {number}" for number in range(9)]
+
+    async def embed():
+        try:
+            return await provider.aembed_documents(texts)
+        finally:
+            await provider.aclose()
+
+    embeddings = asyncio.run(embed())
+
+    assert sorted(servers[0].batches) == [[0, 1], [2, 3], [4, 5], [6, 7], [8]]
+    assert [row[0] for row in embeddings] == list(range(len(texts)))
+
+
+def test_a_failing_replica_is_failed_over_and_ejected(servers, create_provider):
+    servers[0].status = 503
+    provider = create_provider([server.url for server in servers])
+
+    for number in range(6):
+        assert provider.embed_documents([f"text {number}"]) == [[number] * DIMENSIONS]
+
+    statistics = provider.get_endpoint_statistics()
+    # two failed requests eject it, every request after that goes to the healthy replica only
+    assert len(servers[0].batches) == 2
+    assert len(servers[1].batches) == 6
+    assert not statistics[servers[0].url]["healthy"]
+    assert statistics[servers[1].url]["healthy"]
+    assert statistics[servers[1].url]["failures"] == 0
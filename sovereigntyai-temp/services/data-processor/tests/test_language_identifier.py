@@ -0,0 +1,51 @@
+import pytest
+
+from modules.language_identifier import LanguageIdentifier
+
+SAMPLE_SIZE = 300
+ENGLISH = "The tax administration collects income tax and value added tax. "
+FINNISH = "Verohallinto kerää tuloveron ja arvonlisäveron. Verokortti näyttää pidätysprosentin. "
+
+
+def detected_texts(monkeypatch):
+    # the texts detect samples
+    texts = []
+    monkeypatch.setattr(LanguageIdentifier, "_sample", lambda self, text: texts.append(text) or text)
+    return texts
+
+
+@pytest.mark.parametrize("text", [
+    pytest.param(ENGLISH, id="short"),
+    pytest.param("Line one\r\nline two\rline three\n", id="newlines"),
+    pytest.param((FINNISH * 4)[:SAMPLE_SIZE], id="more bytes than the sample but not more characters"),
+])
+def test_detect_file_detects_a_small_file_on_its_whole_text(text, tmp_path, monkeypatch):
+    file = tmp_path / "file.txt"
+    file.write_bytes(text.encode("utf-8"))
+    identifier = LanguageIdentifier(sample_size=SAMPLE_SIZE, seed=0)
+    texts = detected_texts(monkeypatch)
+
+    identifier.detect_file(str(file))
+
+    assert texts == [text.replace("\r\n", "\n").replace("\r", "\n")]
+
+
+def test_detect_file_reads_windows_of_a_large_file(tmp_path, monkeypatch):
+    file = tmp_path / "file.txt"
+    file.write_text("a" * 1000 + "b" * 1000 + "c" * 1000, encoding="utf-8")
+    identifier = LanguageIdentifier(sample_size=SAMPLE_SIZE, seed=0)
+    texts = detected_texts(monkeypatch)
+
+    identifier.detect_file(str(file))
+
+    # a third of the sample from the start, the middle and the end
+    assert texts == [" ".join(["a" * 100, "b" * 100, "c" * 100])]
+
+
+@pytest.mark.parametrize("text", [ENGLISH * 3, FINNISH * 3])
+def test_detect_file_gives_the_language_of_detect(text, tmp_path):
+    file = tmp_path / "file.txt"
+    file.write_text(text, encoding="utf-8")
+    identifier = LanguageIdentifier(sample_size=SAMPLE_SIZE, seed=0)
+
+    assert identifier.detect_file(str(file)) == identifier.detect(text)
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from streaming_text_splitter import StreamingTextSplitter
+
+
+def generate_text(seed, words, separators):
+    # random words, each followed by one of separators: a string, or a (string, weight) pair
+    rng = random.Random(seed)
+    choices = [separator if isinstance(separator, tuple) else (separator, 1) for separator in separators]
+    parts = []
+    for _ in range(words):
+        parts.append("".join(rng.choice("abcdefghijklmnopqrstuvwxyzäö") for _ in range(rng.randint(1, 12))))
+        parts.append(rng.choices([c[0] for c in choices], weights=[c[1] for c in choices])[0])
+    return "".join(parts)
+
+
+def split_both(tmp_path, text, chunk_size, chunk_overlap, window_size, newline="\n"):
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        is_separator_regex=False,
+    )
+    file = tmp_path / "file.txt"
+    file.write_text(text.replace("\n", newline), encoding="utf-8", newline="")
+    streamed = list(StreamingTextSplitter(text_splitter, chunk_size, chunk_overlap, window_size).split_file(str(file)))
+    return streamed, text_splitter.split_text(text)
+
+
+PARAGRAPHS = [(" ", 90), ("\n", 8), ("\n\n", 2)]
+LINES = [(" ", 90), ("\n", 10)]
+WORDS = [(" ", 95), ("  ", 5)]
+BLANK_LINES = [(" ", 90), ("\n\n", 4), ("\n\n\n", 3), ("\n\n\n\n", 2), ("\n\n\n\n\n", 1)]
+
+
+@pytest.mark.parametrize("separators", [PARAGRAPHS, LINES, WORDS, BLANK_LINES])
+@pytest.mark.parametrize(("chunk_size", "chunk_overlap", "window_size"), [
+    (200, 20, 1000),
+    (100, 0, 400),
+    (100, 50, 500),
+    (500, 100, 2500),
+])
+def test_split_file_equals_split_text(tmp_path, separators, chunk_size, chunk_overlap, window_size):
+    text = generate_text(0, 8000, separators)
+
+    streamed, expected = split_both(tmp_path, text, chunk_size, chunk_overlap, window_size)
+
+    assert streamed == expected
+
+
+def test_split_file_equals_split_text_with_the_default_settings(tmp_path):
+    text = generate_text(1, 120000, PARAGRAPHS)
+
+    streamed, expected = split_both(tmp_path, text, 3000, 300, 65536)
+
+    assert len(expected) > 100
+    assert streamed == expected
+
+
+def test_split_file_equals_split_text_across_pieces_longer_than_the_windows(tmp_path):
+    # paragraphs of lines, one of them a line without spaces, and lines before the first paragraph break:
+    # the splitter splits those pieces again with the separators after theirs
+    text = "".join([
+        generate_text(2, 3000, LINES),
+        "\n\n",
+        generate_text(3, 2000, [""]),
+        "\n",
+        generate_text(4, 3000, PARAGRAPHS),
+    ])
+
+    streamed, expected = split_both(tmp_path, text, 100, 20, 400)
+
+    assert streamed == expected
+
+
+def test_split_file_reads_crlf_and_multibyte_characters_across_windows(tmp_path):
+    text = generate_text(5, 3000, [("€ ", 90), ("\n", 10)])
+
+    # a window of an odd number of bytes ends inside the characters and between "\r" and "\n"
+    streamed, expected = split_both(tmp_path, text, 100, 10, 401, newline="\r\n")
+
+    assert streamed == expected
+
+
+def test_window_smaller_than_four_chunks_is_rejected():
+    with pytest.raises(ValueError):
+        StreamingTextSplitter(RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=0), 100, 0, 399)
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from modules.file_logger import FileLogger
+
+
+class EmbeddingBatcher:
+
+    PRIORITIES = ("high", "low")
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            encode: Callable[[list[str]], np.ndarray],
+            get_dimensions: Callable[[], int],
+            max_batch_size: int,
+            max_wait_time: float,
+            executor: Executor,
+            max_concurrency: int,
+            high_priority_max_wait_time: float,
+            high_priority_latency_target: float,
+    ) -> None:
+        self._logger = logger
+        self._encode = encode
+        self._get_dimensions = get_dimensions
+        self._max_batch_size = max_batch_size
+        self._max_wait_time = max_wait_time
+        self._executor = executor
+        self._max_concurrency = max_concurrency
+        self._high_priority_max_wait_time = high_priority_max_wait_time
+        self._high_priority_latency_target = high_priority_latency_target
+        self._lanes: dict[str, deque[tuple[str, asyncio.Future, float]]] = {
+            priority: deque() for priority in self.PRIORITIES
+        }
+        self._available: asyncio.Event | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._worker: asyncio.Task | None = None
+        self._encodings: set[asyncio.Task] = set()
+        # moving average of encode seconds per text, used to size bulk batches to the latency target
+        self._seconds_per_text: float | None = None
+        self._statistics = {
+            priority: {"batches": 0, "texts": 0, "queue_time": 0.0, "max_queue_time": 0.0}
+            for priority in self.PRIORITIES
+        }
+
+    async def start(self) -> None:
+        self._available = asyncio.Event()
+        self._slots = asyncio.Semaphore(self._max_concurrency)
+        self._worker = asyncio.create_task(self._run())
+        self._logger.info(
+            f"Embedding batcher started "
+            f"(max_batch_size={self._max_batch_size}, max_wait_time={self._max_wait_time}s, "
+            f"max_concurrency={self._max_concurrency}, "
+            f"high_priority_latency_target={self._high_priority_latency_target}s)"
+        )
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        for encoding in list(self._encodings):
+            encoding.cancel()
+        await asyncio.gather(*self._encodings, return_exceptions=True)
+
+        for lane in self._lanes.values():
+            self._fail(list(lane), RuntimeError("Embedding batcher stopped."))
+            lane.clear()
+
+    async def submit(self, texts: list[str], priority: str = "low") -> np.ndarray:
+        if self._available is None:
+            raise RuntimeError("Embedding batcher is not running.")
+        if priority not in self.PRIORITIES:
+            raise ValueError(f"Invalid priority: {priority}. Expected one of {self.PRIORITIES}.")
+        if not texts:
+            # nothing to stack, but callers still get a matrix with the model's width
+            return np.empty((0, self._get_dimensions()), dtype=np.float32)
+
+        loop = asyncio.get_running_loop()
+        lane = self._lanes[priority]
+        enqueued_at = time.perf_counter()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            lane.append((text, future, enqueued_at))
+            futures.append(future)
+        self._available.set()
+
+        rows = await asyncio.gather(*futures)
+        return np.stack(rows)
+
+    @staticmethod
+    def _fail(batch: list[tuple[str, asyncio.Future, float]], error: BaseException) -> None:
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def get_statistics(self) -> dict:
+        return {
+            "lanes": {
+                priority: {
+                    "batches": statistics["batches"],
+                    "texts": statistics["texts"],
+                    "average_batch_size": (
+                        statistics["texts"] / statistics["batches"] if statistics["batches"] else 0.0
+                    ),
+                    "average_queue_time_ms": (
+                        1000 * statistics["queue_time"] / statistics["texts"] if statistics["texts"] else 0.0
+                    ),
+                    "max_queue_time_ms": 1000 * statistics["max_queue_time"],
+                    "queued": len(self._lanes[priority]),
+                }
+                for priority, statistics in self._statistics.items()
+            },
+            "low_priority_batch_size": self._get_low_priority_batch_size(),
+            "encoding": len(self._encodings),
+        }
+
+    def _get_low_priority_batch_size(self) -> int:
+        # bulk batches are kept short enough that a waiting query is served within the latency target
+        if self._seconds_per_text is None or self._high_priority_latency_target <= 0:
+            return self._max_batch_size
+        return max(1, min(self._max_batch_size, int(self._high_priority_latency_target / self._seconds_per_text)))
+
+    async def _wait_for_texts(self) -> None:
+        while not any(self._lanes.values()):
+            self._available.clear()
+            await self._available.wait()
+
+    async def _collect(self) -> tuple[str, list[tuple[str, asyncio.Future, float]]]:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self._wait_for_texts()
+
+            priority = "high" if self._lanes["high"] else "low"
+            lane = self._lanes[priority]
+            if priority == "high":
+                max_batch_size = self._max_batch_size
+                deadline = loop.time() + self._high_priority_max_wait_time
+            else:
+                max_batch_size = self._get_low_priority_batch_size()
+                deadline = loop.time() + self._max_wait_time
+
+            batch = []
+            preempted = False
+            while len(batch) < max_batch_size:
+                # take everything that is already waiting before sleeping on the lane
+                if lane:
+                    batch.append(lane.popleft())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+
+                self._available.clear()
+                try:
+                    await asyncio.wait_for(self._available.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                except asyncio.CancelledError:
+                    lane.extendleft(reversed(batch))
+                    raise
+
+                if priority == "low" and self._lanes["high"]:
+                    preempted = True
+                    break
+
+            if preempted:
+                # a query arrived while bulk texts were being gathered, they go back to the front
+                lane.extendleft(reversed(batch))
+                continue
+
+            return priority, batch
+
+    async def _run(self) -> None:
+        while True:
+            # wait for a free inference slot first, so texts arriving meanwhile join the next batch
+            await self._slots.acquire()
+            try:
+                priority, batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            # callers that disconnected in the meantime cancel their futures
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            encoding = asyncio.create_task(self._encode_batch(priority, batch))
+            self._encodings.add(encoding)
+            encoding.add_done_callback(self._encodings.discard)
+
+    async def _encode_batch(self, priority: str, batch: list[tuple[str, asyncio.Future, float]]) -> None:
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        try:
+            embeddings = await loop.run_in_executor(
+                self._executor, self._encode, [text for text, _, _ in batch],
+            )
+        except asyncio.CancelledError:
+            self._fail(batch, RuntimeError("Embedding batcher stopped."))
+            raise
+        except Exception as e:
+            self._logger.error(f"Batch encode of {len(batch)} {priority} priority texts failed: {e}")
+            self._fail(batch, e)
+            return
+        finally:
+            self._slots.release()
+
+        if priority == "low":
+            seconds_per_text = (time.perf_counter() - started_at) / len(batch)
+            self._seconds_per_text = (
+                seconds_per_text if self._seconds_per_text is None
+                else 0.8 * self._seconds_per_text + 0.2 * seconds_per_text
+            )
+
+        statistics = self._statistics[priority]
+        statistics["batches"] += 1
+        statistics["texts"] += len(batch)
+        for _, _, enqueued_at in batch:
+            queue_time = started_at - enqueued_at
+            statistics["queue_time"] += queue_time
+            statistics["max_queue_time"] = max(statistics["max_queue_time"], queue_time)
+
+        for (_, future, _), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
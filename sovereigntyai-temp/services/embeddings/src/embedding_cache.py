@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from modules.file_logger import FileLogger
+
+
+class EmbeddingCache:
+
+    # keeps "IN (...)" lookups below SQLite's host parameter limit
+    _DISK_LOOKUP_SIZE = 500
+
+    def __init__(
+            self,
+            logger: FileLogger,
+            model_name: str,
+            memory_max_entries: int,
+            directory: Path | None,
+    ) -> None:
+        self._logger = logger
+        self._model_name = model_name
+        self._memory_max_entries = memory_max_entries
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        self._connection: sqlite3.Connection | None = None
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+            file = directory / "embedding_cache.sqlite3"
+            self._connection = sqlite3.connect(file, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)"
+            )
+            self._connection.commit()
+            self._logger.info(f"Persistent embedding cache opened at {file}")
+
+    def _create_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self._model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        keys = [self._create_key(text) for text in texts]
+        results: list[np.ndarray | None] = [None] * len(texts)
+
+        with self._lock:
+            disk_positions: dict[str, list[int]] = {}
+            for position, key in enumerate(keys):
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[position] = embedding
+                    self._memory_hits += 1
+                else:
+                    disk_positions.setdefault(key, []).append(position)
+
+            if disk_positions and self._connection is not None:
+                disk_keys = list(disk_positions)
+                for start in range(0, len(disk_keys), self._DISK_LOOKUP_SIZE):
+                    chunk = disk_keys[start:start + self._DISK_LOOKUP_SIZE]
+                    rows = self._connection.execute(
+                        f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, embedding)
+                        for position in disk_positions.pop(key):
+                            results[position] = embedding
+                            self._disk_hits += 1
+
+            self._misses += sum(len(positions) for positions in disk_positions.values())
+
+        return results
+
+    def put_many(self, texts: list[str], embeddings: np.ndarray) -> None:
+        keys = [self._create_key(text) for text in texts]
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        with self._lock:
+            for key, embedding in zip(keys, embeddings):
+                self._remember(key, embedding)
+
+            if self._connection is not None:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, embedding) VALUES (?, ?)",
+                    [(key, embedding.tobytes()) for key, embedding in zip(keys, embeddings)],
+                )
+                self._connection.commit()
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        if self._memory_max_entries <= 0:
+            return
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def get_statistics(self) -> dict:
+        lookups = self._memory_hits + self._disk_hits + self._misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_ratio": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+
+import numpy as np
+from starlette.responses import StreamingResponse
+
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+if TYPE_CHECKING:
+    from starlette.requests import Request
+    from starlette.types import Receive, Scope, Send
+
+    from modules.file_logger import FileLogger
+
+
+class NdjsonStreamingResponse(StreamingResponse):
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # the body iterator is still reading the request body, so receive() must not be consumed
+        # in parallel by Starlette's disconnect listener
+        await self.stream_response(send)
+
+
+class EmbeddingStreamer:
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            embed: Callable[[list[str], str], Awaitable[np.ndarray]],
+            batch_size: int,
+            max_in_flight: int,
+            max_text_length: int,
+    ) -> None:
+        self._logger = logger
+        self._embed = embed
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
+        self._max_text_length = max_text_length
+
+    @staticmethod
+    async def _read_lines(http_request: Request) -> AsyncIterator[bytes]:
+        buffer = b""
+        async for chunk in http_request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+
+    def _parse_item(self, item: object) -> str:
+        if not isinstance(item, dict):
+            raise ValueError("each line must be a JSON object with 'id' and 'text'")
+
+        text = item.get("text")
+        if not isinstance(text, str) or not 1 <= len(text) <= self._max_text_length:
+            raise ValueError(f"'text' must be a string of 1 to {self._max_text_length} characters")
+        return text
+
+    @staticmethod
+    def _create_line(record: dict) -> bytes:
+        return json.dumps(record).encode("utf-8") + b"\n"
+
+    async def stream(
+            self,
+            http_request: Request,
+            priority: str,
+            normalize: bool = False,
+            quantization: str = "none",
+    ) -> AsyncIterator[bytes]:
+        # results leave in input order; the reader never waits for the client to consume output,
+        # only for free encoding slots, so a client that uploads everything first cannot deadlock us
+        output: asyncio.Queue[bytes | asyncio.Task | None] = asyncio.Queue()
+        in_flight = asyncio.Semaphore(self._max_in_flight)
+
+        async def embed_window(window: list[tuple[object, str]]) -> bytes:
+            try:
+                embeddings = await self._embed([text for _, text in window], priority)
+                # the same vectors as /embed_documents gives for these options
+                embeddings = EmbeddingWireFormat.prepare(embeddings, normalize, quantization)
+                values, scales = EmbeddingWireFormat.quantize_for_json(embeddings, quantization)
+                return b"".join(
+                    self._create_line({
+                        "id": item_id,
+                        "embedding": value,
+                        "quantization": quantization,
+                        "scale": scales[index] if scales is not None else None,
+                        "dimensions": embeddings.shape[1],
+                    })
+                    for index, ((item_id, _), value) in enumerate(zip(window, values))
+                )
+            except Exception as e:
+                self._logger.error(f"Streaming embedding of {len(window)} texts failed: {e}")
+                return b"".join(self._create_line({"id": item_id, "error": str(e)}) for item_id, _ in window)
+            finally:
+                in_flight.release()
+
+        async def submit(window: list[tuple[object, str]]) -> None:
+            await in_flight.acquire()
+            output.put_nowait(asyncio.create_task(embed_window(window)))
+
+        async def read() -> None:
+            try:
+                window = []
+                async for line in self._read_lines(http_request):
+                    item_id = None
+                    try:
+                        item = json.loads(line)
+                        item_id = item.get("id") if isinstance(item, dict) else None
+                        window.append((item_id, self._parse_item(item)))
+                    except ValueError as e:
+                        # the lines read before it are submitted first, so the error keeps its place in the output
+                        if window:
+                            await submit(window)
+                            window = []
+                        output.put_nowait(self._create_line({"id": item_id, "error": f"Invalid line: {e}"}))
+                        continue
+
+                    if len(window) >= self._batch_size:
+                        await submit(window)
+                        window = []
+
+                if window:
+                    await submit(window)
+            finally:
+                output.put_nowait(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            while (item := await output.get()) is not None:
+                yield item if isinstance(item, bytes) else await item
+            await reader
+        finally:
+            reader.cancel()
+            while not output.empty():
+                item = output.get_nowait()
+                if isinstance(item, asyncio.Task):
+                    item.cancel()
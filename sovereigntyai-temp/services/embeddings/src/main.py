@@ -1,11 +1,29 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Literal
+
+import numpy as np
 import torch
 from pydantic import BaseModel, constr, Field
-from sentence_transformers import SentenceTransformer
 from fastapi import FastAPI, HTTPException
-from starlette.responses import RedirectResponse
+from starlette.requests import Request
+from starlette.responses import JSONResponse, RedirectResponse, Response
 
 from modules.configuration_manager import ConfigurationManager
 from modules.file_logger import FileLogger
+from modules.embedding_encoder import EmbeddingEncoder
+from modules.embedding_model_loader import EmbeddingModelLoader
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from embedding_streamer import EmbeddingStreamer, NdjsonStreamingResponse
+
+MODEL_NAME = EmbeddingModelLoader.MODEL_NAME
+MAX_TEXT_LENGTH = 5120
 
 configuration_manager = ConfigurationManager()
 
@@ -14,22 +32,151 @@ logger = FileLogger(
     configuration_manager=configuration_manager,
 )
 
-app = FastAPI(title="Embeddings")
+model_loader = EmbeddingModelLoader.from_configuration(logger=logger, configuration_manager=configuration_manager)
+device = model_loader.device
+backend = model_loader.backend
+
+# the model is loaded and warmed up in the startup phase, the endpoints answer 503 until then
+model = None
+embedding_encoder: EmbeddingEncoder | None = None
+parity = None
+startup = {
+    "state": "starting",
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "error": None,
+}
+
+
+def load_model() -> None:
+    global model, embedding_encoder, parity
+
+    load_started_at = time.perf_counter()
+    model = model_loader.load()
+    embedding_encoder = EmbeddingEncoder.from_configuration(
+        logger=logger, configuration_manager=configuration_manager, model=model,
+    )
+    startup["load_seconds"] = round(time.perf_counter() - load_started_at, 3)
+
+    if backend != "torch" and configuration_manager.get_value(
+            "embedding_model.parity_check_on_startup").lower() == "true":
+        parity = model_loader.check_parity(model)
+        logger.info(f"Parity of backend '{backend}' against torch: {parity}")
+
+    if model_loader.warmup:
+        warmup_started_at = time.perf_counter()
+        model_loader.warm_up(
+            encode=encode_texts,
+            max_seq_length=model.max_seq_length,
+            batch_size=embedding_encoder.bucket_size,
+        )
+        startup["warmup_seconds"] = round(time.perf_counter() - warmup_started_at, 3)
+
+    logger.info(f"Embedding model ready: {startup}")
+
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    return embedding_encoder.encode(texts)
+
+
+inference_max_concurrency = int(configuration_manager.get_value("embedding_inference.max_concurrency"))
+
+# model.encode blocks, so it runs on dedicated threads instead of the event loop
+inference_executor = ThreadPoolExecutor(
+    max_workers=inference_max_concurrency,
+    thread_name_prefix="inference",
+)
+
+embedding_batcher = EmbeddingBatcher(
+    logger=logger,
+    encode=encode_texts,
+    get_dimensions=lambda: model.get_sentence_embedding_dimension(),
+    max_batch_size=int(configuration_manager.get_value("embedding_batcher.max_batch_size")),
+    max_wait_time=float(configuration_manager.get_value("embedding_batcher.max_wait_time_ms")) / 1000,
+    executor=inference_executor,
+    max_concurrency=inference_max_concurrency,
+    high_priority_max_wait_time=float(
+        configuration_manager.get_value("embedding_batcher.high_priority_max_wait_time_ms")
+    ) / 1000,
+    high_priority_latency_target=float(
+        configuration_manager.get_value("embedding_batcher.high_priority_latency_target_ms")
+    ) / 1000,
+)
+
+embedding_cache = None
+if configuration_manager.get_value("embedding_cache.enabled").lower() == "true":
+    embedding_cache = EmbeddingCache(
+        logger=logger,
+        # vectors from different backends are not interchangeable, keep them apart in the cache
+        model_name=f"{MODEL_NAME}:{backend}",
+        memory_max_entries=int(configuration_manager.get_value("embedding_cache.memory_max_entries")),
+        directory=(
+            Path(configuration_manager.get_value("persistent-volume.embeddings_hf_home")) / "embedding_cache"
+            if configuration_manager.get_value("embedding_cache.disk_enabled").lower() == "true"
+            else None
+        ),
+    )
+
+
+async def embed_texts(texts: list[str], priority: str) -> np.ndarray:
+    if embedding_cache is None or not texts:
+        return await embedding_batcher.submit(texts, priority=priority)
+
+    cached = await asyncio.to_thread(embedding_cache.get_many, texts)
+
+    # only texts that missed the cache go to the model, each distinct text once
+    missing = list(dict.fromkeys(text for text, embedding in zip(texts, cached) if embedding is None))
+    if missing:
+        encoded = await embedding_batcher.submit(missing, priority=priority)
+        await asyncio.to_thread(embedding_cache.put_many, missing, encoded)
+        encoded_by_text = dict(zip(missing, encoded))
+        cached = [
+            embedding if embedding is not None else encoded_by_text[text]
+            for text, embedding in zip(texts, cached)
+        ]
+
+    return np.stack(cached)
 
-if torch.cuda.is_available():
-    device = torch.device("cuda")
-elif torch.backends.mps.is_available():
-    device = torch.device("mps")
-else:
-    device = torch.device("cpu")
 
-model = SentenceTransformer(
-    model_name_or_path="sentence-transformers/all-mpnet-base-v2",
-    device=str(device),
-    cache_folder=configuration_manager.get_value("persistent-volume.embeddings_hf_home"),
-    # local_files_only=True,
+embedding_streamer = EmbeddingStreamer(
+    logger=logger,
+    embed=embed_texts,
+    batch_size=int(configuration_manager.get_value("embedding_streamer.batch_size")),
+    max_in_flight=int(configuration_manager.get_value("embedding_streamer.max_in_flight")),
+    max_text_length=MAX_TEXT_LENGTH,
 )
-model.to(device)
+
+
+async def start_model() -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(inference_executor, load_model)
+        startup["state"] = "ready"
+    except Exception as e:
+        startup["state"] = "failed"
+        startup["error"] = str(e)
+        logger.exception(f"Embedding model startup failed: {e}")
+
+
+def ensure_ready() -> None:
+    if startup["state"] != "ready":
+        raise HTTPException(status_code=503, detail=f"Embedding model is not ready ({startup['state']}).")
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    await embedding_batcher.start()
+    # the server starts listening right away, so /status answers liveness probes during the load
+    startup_task = asyncio.create_task(start_model())
+    yield
+    startup_task.cancel()
+    await embedding_batcher.stop()
+    inference_executor.shutdown(wait=True)
+    if embedding_cache is not None:
+        embedding_cache.close()
+
+
+app = FastAPI(title="Embeddings", lifespan=lifespan)
 
 
 @app.get("/")
@@ -37,67 +184,163 @@ async def redirect_root():
     return RedirectResponse(url="/docs")
 
 
+@app.get("/ready")
+async def read_ready() -> JSONResponse:
+    return JSONResponse(
+        status_code=200 if startup["state"] == "ready" else 503,
+        content={"ready": startup["state"] == "ready", **startup},
+    )
+
+
 @app.get("/status")
 async def read_root() -> dict:
     return {
         "message": "Embedding API is running",
+        "startup": startup,
         "hardware": str(device),
+        "backend": backend,
+        "parity": parity,
+        "torch_threads": {
+            "intra_op": torch.get_num_threads(),
+            "inter_op": torch.get_num_interop_threads(),
+        },
+        "batcher": embedding_batcher.get_statistics(),
+        "encoder": embedding_encoder.get_statistics() if embedding_encoder is not None else None,
+        "cache": embedding_cache.get_statistics() if embedding_cache is not None else None,
     }
 
 
+@app.get("/parity")
+async def read_parity() -> dict:
+    # loads a torch reference model on demand, so this is a diagnostic endpoint, not a health check
+    ensure_ready()
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(inference_executor, model_loader.check_parity, model)
+    return {"backend": backend, **result}
+
+
+def get_priority(http_request: Request, default: str) -> str:
+    # callers may move their work to another lane, e.g. a bulk job marking itself interactive
+    priority = http_request.headers.get("x-embedding-priority", default).strip().lower()
+    if priority not in EmbeddingBatcher.PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid X-Embedding-Priority: {priority}. Expected one of {EmbeddingBatcher.PRIORITIES}.",
+        )
+    return priority
+
+
+def create_binary_response(http_request: Request, embeddings: np.ndarray, quantization: str) -> Response | None:
+    # clients opt in to the binary frame through the Accept header, everyone else gets JSON
+    wire_format = EmbeddingWireFormat.parse_accept_header(http_request.headers.get("accept"))
+    if wire_format is None:
+        return None
+
+    dtype, compression = wire_format
+    if quantization != "none":
+        dtype = quantization
+    return Response(
+        content=EmbeddingWireFormat.encode(embeddings, dtype=dtype, compression=compression),
+        media_type=EmbeddingWireFormat.MEDIA_TYPE,
+    )
+
+
+Quantization = Literal["none", "float16", "int8", "binary"]
+
+
 class EmbedDocumentsRequest(BaseModel):
-    texts: list[constr(min_length=1, max_length=5120)] = Field(...)
+    texts: list[constr(min_length=1, max_length=MAX_TEXT_LENGTH)] = Field(...)
+    normalize: bool = False
+    quantization: Quantization = "none"
 
 
 class EmbedDocumentsResponse(BaseModel):
-    embeddings: list[list[float]] = None
-    error: str = None
+    # int8 rows come with one scale per row, binary rows are packed sign bits of 'dimensions' components
+    embeddings: list[list[int]] | list[list[float]] | None = None
+    quantization: Quantization = "none"
+    scales: list[float] | None = None
+    dimensions: int | None = None
+    error: str | None = None
 
 
 @app.post("/embed_documents", response_model=EmbedDocumentsResponse)
-async def embed_documents(request: EmbedDocumentsRequest) -> EmbedDocumentsResponse | HTTPException:
+async def embed_documents(
+        request: EmbedDocumentsRequest,
+        http_request: Request,
+) -> EmbedDocumentsResponse | Response | HTTPException:
+    ensure_ready()
+    priority = get_priority(http_request, default="low")
     try:
         texts = request.texts
-        with torch.no_grad():
-            embeddings = [
-                model.encode(text, convert_to_tensor=True)
-                .to(device)
-                .cpu()
-                .numpy()
-                .tolist()
-                for text in texts
-            ]
-        return EmbedDocumentsResponse(embeddings=embeddings)
+        embeddings = await embed_texts(texts, priority)
+        embeddings = EmbeddingWireFormat.prepare(embeddings, request.normalize, request.quantization)
+        binary_response = create_binary_response(http_request, embeddings, request.quantization)
+        if binary_response is not None:
+            return binary_response
+        values, scales = EmbeddingWireFormat.quantize_for_json(embeddings, request.quantization)
+        return EmbedDocumentsResponse(
+            embeddings=values,
+            quantization=request.quantization,
+            scales=scales,
+            dimensions=embeddings.shape[1],
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 class EmbedQueryRequest(BaseModel):
-    text: constr(min_length=1, max_length=5120)
+    text: constr(min_length=1, max_length=MAX_TEXT_LENGTH)
+    normalize: bool = False
+    quantization: Quantization = "none"
 
 
 class EmbedQueryResponse(BaseModel):
-    embedding: list[float] = None
-    error: str = None
+    embedding: list[int] | list[float] | None = None
+    quantization: Quantization = "none"
+    scale: float | None = None
+    dimensions: int | None = None
+    error: str | None = None
 
 
 @app.post("/embed_query", response_model=EmbedQueryResponse)
-async def embed_query(request: EmbedQueryRequest) -> EmbedQueryResponse | HTTPException:
+async def embed_query(
+        request: EmbedQueryRequest,
+        http_request: Request,
+) -> EmbedQueryResponse | Response | HTTPException:
+    ensure_ready()
+    priority = get_priority(http_request, default="high")
     try:
         text = request.text
-        with torch.no_grad():
-            embedding = (
-                model.encode(text, convert_to_tensor=True)
-                .to(device)
-                .cpu()
-                .numpy()
-                .tolist()
-            )
-        return EmbedQueryResponse(embedding=embedding)
+        embeddings = await embed_texts([text], priority)
+        embeddings = EmbeddingWireFormat.prepare(embeddings, request.normalize, request.quantization)
+        binary_response = create_binary_response(http_request, embeddings, request.quantization)
+        if binary_response is not None:
+            return binary_response
+        values, scales = EmbeddingWireFormat.quantize_for_json(embeddings, request.quantization)
+        return EmbedQueryResponse(
+            embedding=values[0],
+            quantization=request.quantization,
+            scale=scales[0] if scales is not None else None,
+            dimensions=embeddings.shape[1],
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/embed_documents_stream", response_class=NdjsonStreamingResponse)
+async def embed_documents_stream(
+        http_request: Request,
+        normalize: bool = False,
+        quantization: Quantization = "none",
+) -> NdjsonStreamingResponse:
+    # NDJSON in: {"id": ..., "text": ...} per line; NDJSON out: {"id": ..., "embedding": [...], ...} per line with
+    # the fields of /embed_query (or {"id": ..., "error": ...}), written as soon as each batch is encoded.
+    # normalize and quantization are query parameters, the body is the NDJSON stream
+    ensure_ready()
+    priority = get_priority(http_request, default="low")
+    return NdjsonStreamingResponse(embedding_streamer.stream(http_request, priority, normalize, quantization))
+
+
 # for debugging only
 if __name__ == "__main__":
     import uvicorn
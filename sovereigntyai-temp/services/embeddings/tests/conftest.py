@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the image copies the shared modules next to the service sources, the tests put both on the path instead
+SERVICES_DIRECTORY = Path(__file__).resolve().parents[2]
+sys.path[:0] = [str(SERVICES_DIRECTORY / "embeddings" / "src"), str(SERVICES_DIRECTORY / "shared")]
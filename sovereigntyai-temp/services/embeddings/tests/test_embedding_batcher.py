@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+DIMENSIONS = 8
+
+
+def run_with_batcher(encode, submit):
+    async def run():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            batcher = EmbeddingBatcher(
+                logger=logging.getLogger(__name__),
+                encode=encode,
+                get_dimensions=lambda: DIMENSIONS,
+                max_batch_size=4,
+                max_wait_time=0.001,
+                executor=executor,
+                max_concurrency=1,
+                high_priority_max_wait_time=0.0,
+                high_priority_latency_target=0.0,
+            )
+            await batcher.start()
+            try:
+                return await submit(batcher)
+            finally:
+                await batcher.stop()
+
+    return asyncio.run(run())
+
+
+def encode_lengths(texts):
+    return np.array([[len(text)] * DIMENSIONS for text in texts], dtype=np.float32)
+
+
+def test_submit_without_texts_returns_an_empty_matrix_without_encoding():
+    encoded = []
+
+    def encode(texts):
+        encoded.append(texts)
+        return encode_lengths(texts)
+
+    embeddings = run_with_batcher(encode, lambda batcher: batcher.submit([]))
+
+    assert embeddings.shape == (0, DIMENSIONS)
+    assert embeddings.dtype == np.float32
+    assert encoded == []
+
+
+def test_submit_returns_the_rows_in_input_order():
+    texts = ["a", "bbb", "cc", "dddd", "eeeee", "f"]
+
+    embeddings = run_with_batcher(encode_lengths, lambda batcher: batcher.submit(texts))
+
+    assert embeddings.shape == (len(texts), DIMENSIONS)
+    assert embeddings[:, 0].tolist() == [len(text) for text in texts]
+
+
+def test_empty_matrix_passes_through_normalization_and_every_wire_format():
+    embeddings = EmbeddingWireFormat.prepare(np.empty((0, DIMENSIONS), dtype=np.float32), True, "none")
+
+    for dtype in EmbeddingWireFormat.DTYPES:
+        decoded = EmbeddingWireFormat.decode(EmbeddingWireFormat.encode(embeddings, dtype=dtype))
+        assert decoded.shape == (0, DIMENSIONS)
+
+
+def test_a_query_is_encoded_before_the_bulk_texts_queued_ahead_of_it():
+    encoded = []
+    first_batch_done = threading.Event()
+
+    def encode(texts):
+        encoded.append(texts)
+        # hold the only inference slot until both lanes have texts waiting
+        first_batch_done.wait(5)
+        return encode_lengths(texts)
+
+    async def submit(batcher):
+        first = asyncio.create_task(batcher.submit(["l1", "l2", "l3", "l4"]))
+        while not encoded:
+            await asyncio.sleep(0.001)
+        bulk = asyncio.create_task(batcher.submit(["l5", "l6"]))
+        query = asyncio.create_task(batcher.submit(["h"], priority="high"))
+        await asyncio.sleep(0.01)
+        first_batch_done.set()
+        await asyncio.gather(first, bulk, query)
+        return batcher.get_statistics()
+
+    statistics = run_with_batcher(encode, submit)
+
+    assert encoded == [["l1", "l2", "l3", "l4"], ["h"], ["l5", "l6"]]
+    assert statistics["lanes"]["high"]["texts"] == 1
+    assert statistics["lanes"]["low"]["texts"] == 6
+
+
+def test_submit_rejects_an_unknown_priority():
+    async def submit(batcher):
+        with pytest.raises(ValueError, match="Invalid priority"):
+            await batcher.submit(["a"], priority="urgent")
+
+    run_with_batcher(encode_lengths, submit)
@@ -0,0 +1,70 @@
+import logging
+
+import numpy as np
+
+from modules.embedding_encoder import EmbeddingEncoder
+
+
+class Model:
+    # a token per word plus the two special tokens; the embedding of a text holds its word count
+    max_seq_length = 16
+
+    def __init__(self):
+        self.batches = []
+
+    def tokenizer(self, texts, max_length, **kwargs):
+        return {"input_ids": [[0] * min(len(text.split()) + 2, max_length) for text in texts]}
+
+    def encode(self, texts, batch_size, **kwargs):
+        self.batches.append([len(text.split()) for text in texts])
+        return np.array([[len(text.split())] * 4 for text in texts], dtype=np.float32)
+
+
+def create_encoder(model, bucket_size=2, max_bucket_tokens=1000):
+    return EmbeddingEncoder(
+        logger=logging.getLogger(__name__),
+        model=model,
+        bucket_size=bucket_size,
+        max_bucket_tokens=max_bucket_tokens,
+    )
+
+
+def create_texts(word_counts):
+    return [" ".join(["word"] * count) for count in word_counts]
+
+
+def test_encode_returns_the_rows_in_input_order():
+    word_counts = [3, 9, 1, 5, 7, 2]
+
+    embeddings = create_encoder(Model()).encode(create_texts(word_counts))
+
+    assert embeddings[:, 0].tolist() == word_counts
+
+
+def test_encode_buckets_texts_of_similar_length():
+    model = Model()
+
+    create_encoder(model).encode(create_texts([3, 9, 1, 5, 7, 2]))
+
+    assert model.batches == [[9, 7], [5, 3], [2, 1]]
+
+
+def test_a_bucket_holds_no_more_padded_tokens_than_the_limit():
+    model = Model()
+
+    # the longest texts are truncated to 16 tokens and a bucket pads to its longest text, so 40 tokens fit two of them
+    create_encoder(model, bucket_size=8, max_bucket_tokens=40).encode(create_texts([20, 20, 20, 4, 3, 2]))
+
+    assert model.batches == [[20, 20], [20, 4], [3, 2]]
+
+
+def test_statistics_count_the_padding_of_the_buckets():
+    encoder = create_encoder(Model())
+
+    # buckets [6, 4] and [2] are padded to 8 and 4 tokens
+    encoder.encode(create_texts([2, 6, 4]))
+
+    statistics = encoder.get_statistics()
+    assert statistics["buckets"] == 2
+    assert statistics["real_tokens"] == 8 + 6 + 4
+    assert statistics["padded_tokens"] == 2 * 8 + 4
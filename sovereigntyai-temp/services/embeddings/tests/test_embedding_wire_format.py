@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+COMPRESSIONS = EmbeddingWireFormat.available_compressions()
+
+
+def create_embeddings(rows, columns=12):
+    embeddings = np.random.default_rng(rows).standard_normal((rows, columns)).astype(np.float32)
+    return EmbeddingWireFormat.normalize(embeddings)
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize(("dtype", "tolerance"), [("float32", 0), ("float16", 1e-3), ("int8", 1 / 127)])
+@pytest.mark.parametrize("rows", [0, 1, 5])
+def test_decode_returns_the_encoded_matrix(dtype, tolerance, compression, rows):
+    embeddings = create_embeddings(rows)
+
+    decoded = EmbeddingWireFormat.decode(EmbeddingWireFormat.encode(embeddings, dtype=dtype, compression=compression))
+
+    assert decoded.shape == embeddings.shape
+    np.testing.assert_allclose(decoded, embeddings, rtol=0, atol=tolerance)
+
+
+@pytest.mark.parametrize("compression", COMPRESSIONS)
+@pytest.mark.parametrize("columns", [8, 12])
+def test_decode_returns_the_signs_of_a_binary_matrix(compression, columns):
+    embeddings = create_embeddings(5, columns)
+    frame = EmbeddingWireFormat.encode(embeddings, dtype="binary", compression=compression)
+
+    decoded = EmbeddingWireFormat.decode(frame)
+
+    assert decoded.shape == embeddings.shape
+    assert (np.sign(decoded) == np.sign(embeddings)).all()
+    # unit length, like the vectors they stand for
+    np.testing.assert_allclose(np.linalg.norm(decoded, axis=1), 1, rtol=1e-6)
+
+
+def test_decode_rejects_a_frame_of_another_format():
+    frame = EmbeddingWireFormat.encode(create_embeddings(1))
+
+    with pytest.raises(ValueError, match="Unsupported embedding frame"):
+        EmbeddingWireFormat.decode(b"JUNK" + frame[4:])
+    with pytest.raises(ValueError, match="shorter than its header"):
+        EmbeddingWireFormat.decode(frame[:4])
+
+
+@pytest.mark.parametrize(("accept", "expected"), [
+    (None, None),
+    ("application/json", None),
+    (EmbeddingWireFormat.build_accept_header("float16", "gzip"), ("float16", "gzip")),
+    ("application/x-embeddings", ("float32", "none")),
+    # unknown parameters fall back to what every client can read
+    ("application/x-embeddings; dtype=float64; compression=brotli", ("float32", "none")),
+])
+def test_parse_accept_header(accept, expected):
+    assert EmbeddingWireFormat.parse_accept_header(accept) == expected
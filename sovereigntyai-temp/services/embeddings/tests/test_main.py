@@ -0,0 +1,220 @@
+import asyncio
+import importlib
+import json
+
+import httpx
+import numpy as np
+import pytest
+import yaml
+
+from conftest import SERVICES_DIRECTORY
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+DIMENSIONS = 12  # not a multiple of 8, so the packed binary rows have padding bits
+TEXTS = ["first text", "a second, longer text", "third"]
+
+
+def encode_texts(texts):
+    # a fixed vector per text with components of both signs
+    return np.stack([
+        np.random.default_rng(len(text)).standard_normal(DIMENSIONS).astype(np.float32) for text in texts
+    ])
+
+
+class Model:
+    max_seq_length = 512
+
+    def get_sentence_embedding_dimension(self):
+        return DIMENSIONS
+
+
+class Encoder:
+
+    def encode(self, texts):
+        return encode_texts(texts)
+
+    def get_statistics(self):
+        return {}
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    # the service reads its configuration from the working directory at import, the test one keeps logs and the
+    # cache in a temporary directory; the model is replaced by a fixed encoder instead of being loaded
+    directory = tmp_path_factory.mktemp("embeddings")
+    configuration = yaml.safe_load((SERVICES_DIRECTORY / "shared" / "configuration.local.yaml").read_text())
+    configuration["persistent-volume"]["logging"] = str(directory / "logs")
+    configuration["persistent-volume"]["embeddings_hf_home"] = str(directory / "hf_home")
+    configuration["embedding_cache"]["enabled"] = False
+    (directory / "configuration.test.yaml").write_text(yaml.safe_dump(configuration))
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("ENVIRONMENT", "test")
+        monkeypatch.chdir(directory)
+        main = importlib.import_module("main")
+
+    main.model = Model()
+    main.embedding_encoder = Encoder()
+    main.startup["state"] = "ready"
+    yield main
+    main.inference_executor.shutdown(wait=True)
+
+
+def post(main, path, payload=None, headers=None, **kwargs):
+    async def run():
+        await main.embedding_batcher.start()
+        try:
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://embeddings") as client:
+                return await client.post(path, json=payload, headers=headers, **kwargs)
+        finally:
+            await main.embedding_batcher.stop()
+
+    return asyncio.run(run())
+
+
+def assert_embeddings(embeddings, texts, quantization):
+    expected = encode_texts(texts)
+    if quantization == "none":
+        np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+        return
+
+    expected = EmbeddingWireFormat.normalize(expected)
+    match quantization:
+        case "float16":
+            np.testing.assert_allclose(embeddings, expected, atol=1e-3)
+        case "int8":
+            np.testing.assert_allclose(embeddings, expected, atol=1 / 127)
+        case "binary":
+            assert embeddings.shape == expected.shape
+            assert (np.sign(embeddings) == np.sign(expected)).all()
+
+
+def decode_json_rows(body, json_key):
+    rows = [body[json_key]] if json_key == "embedding" else body[json_key]
+    columns = (DIMENSIONS + 7) // 8 if body["quantization"] == "binary" else DIMENSIONS
+    rows = np.asarray(rows).reshape(len(rows), columns)
+    match body["quantization"]:
+        case "int8":
+            scales = body["scales"] if json_key == "embeddings" else [body["scale"]]
+            return EmbeddingWireFormat.dequantize_int8(rows, scales)
+        case "binary":
+            return EmbeddingWireFormat.unpack_binary(rows, DIMENSIONS)
+        case _:
+            return rows
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_documents_answers_json_for_every_quantization(main, quantization):
+    response = post(main, "/embed_documents", {"texts": TEXTS, "quantization": quantization})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["quantization"] == quantization
+    assert body["dimensions"] == DIMENSIONS
+    assert (body["scales"] is not None) == (quantization == "int8")
+    assert_embeddings(decode_json_rows(body, "embeddings"), TEXTS, quantization)
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_documents_answers_json_without_texts(main, quantization):
+    response = post(main, "/embed_documents", {"texts": [], "quantization": quantization})
+
+    assert response.status_code == 200
+    assert response.json()["embeddings"] == []
+    assert response.json()["dimensions"] == DIMENSIONS
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_query_answers_json_for_every_quantization(main, quantization):
+    response = post(main, "/embed_query", {"text": TEXTS[1], "quantization": quantization})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["quantization"] == quantization
+    assert body["dimensions"] == DIMENSIONS
+    assert (body["scale"] is not None) == (quantization == "int8")
+    assert_embeddings(decode_json_rows(body, "embedding"), TEXTS[1:2], quantization)
+
+
+def test_normalize_applies_to_unquantized_json(main):
+    response = post(main, "/embed_documents", {"texts": TEXTS, "normalize": True})
+
+    embeddings = np.asarray(response.json()["embeddings"])
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, rtol=1e-6)
+
+
+def post_binary(main, path, payload, dtype="float32", compression="none"):
+    headers = {"Accept": EmbeddingWireFormat.build_accept_header(dtype, compression)}
+    response = post(main, path, payload, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == EmbeddingWireFormat.MEDIA_TYPE
+    return EmbeddingWireFormat.decode(response.content)
+
+
+@pytest.mark.parametrize("compression", EmbeddingWireFormat.available_compressions())
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_documents_answers_binary_for_every_quantization(main, quantization, compression):
+    embeddings = post_binary(
+        main, "/embed_documents", {"texts": TEXTS, "quantization": quantization}, compression=compression,
+    )
+
+    assert_embeddings(embeddings, TEXTS, quantization)
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_documents_answers_binary_without_texts(main, quantization):
+    embeddings = post_binary(main, "/embed_documents", {"texts": [], "quantization": quantization})
+
+    assert embeddings.shape == (0, DIMENSIONS)
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+def test_embed_query_answers_binary_for_every_quantization(main, quantization):
+    embeddings = post_binary(main, "/embed_query", {"text": TEXTS[1], "quantization": quantization})
+
+    assert_embeddings(embeddings, TEXTS[1:2], quantization)
+
+
+def test_unquantized_binary_answer_uses_the_requested_dtype(main):
+    embeddings = post_binary(main, "/embed_documents", {"texts": TEXTS}, dtype="float16")
+
+    assert embeddings.dtype == np.float16
+    np.testing.assert_allclose(embeddings, encode_texts(TEXTS), atol=1e-2)
+
+
+def post_stream(main, lines, **params):
+    body = "".join(line + "\n" for line in lines).encode("utf-8")
+    response = post(main, "/embed_documents_stream", content=body, params=params)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_stream_keeps_an_invalid_line_in_input_order(main):
+    lines = [
+        json.dumps({"id": 1, "text": TEXTS[0]}),
+        json.dumps({"id": 2, "text": ""}),
+        json.dumps({"id": 3, "text": TEXTS[1]}),
+    ]
+
+    records = post_stream(main, lines)
+
+    assert [record["id"] for record in records] == [1, 2, 3]
+    assert "error" in records[1]
+    assert_embeddings(decode_json_rows(records[0], "embedding"), TEXTS[:1], "none")
+    assert_embeddings(decode_json_rows(records[2], "embedding"), TEXTS[1:2], "none")
+
+
+@pytest.mark.parametrize("quantization", EmbeddingWireFormat.QUANTIZATIONS)
+@pytest.mark.parametrize("normalize", [False, True])
+def test_stream_gives_the_vectors_of_embed_documents(main, quantization, normalize):
+    lines = [json.dumps({"id": index, "text": text}) for index, text in enumerate(TEXTS)]
+
+    records = post_stream(main, lines, normalize=str(normalize).lower(), quantization=quantization)
+    body = post(main, "/embed_documents", {"texts": TEXTS, "normalize": normalize, "quantization": quantization}).json()
+
+    assert [record["id"] for record in records] == list(range(len(TEXTS)))
+    np.testing.assert_array_equal(
+        np.concatenate([decode_json_rows(record, "embedding") for record in records]),
+        decode_json_rows(body, "embeddings"),
+    )
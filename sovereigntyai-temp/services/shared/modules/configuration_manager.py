@@ -54,6 +54,18 @@ class ConfigurationManager:
 
     def get_value(self, keys: str) -> str:
 
+        return str(self._get(keys))
+
+    def get_values(self, keys: str) -> list[str]:
+
+        # a YAML list, or a single value that is treated as a list of one
+        value = self._get(keys)
+        if isinstance(value, list):
+            return [str(item) for item in value]
+        return [str(value)]
+
+    def _get(self, keys: str) -> Any:
+
         if not all(char.islower() or char in ["-", "_", "."] for char in keys) or not keys.isascii():
             raise ValueError("The string can only contain lowercase ASCII characters and dots.")
 
@@ -67,4 +79,4 @@ class ConfigurationManager:
             else:
                 raise KeyError(f"Key '{key}' not found in the configuration at level: {current_level}")
 
-        return str(current_level)
+        return current_level
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import TYPE_CHECKING
+
+import numpy as np
+import torch
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+    from configuration_manager import ConfigurationManager
+    from file_logger import FileLogger
+
+
+class EmbeddingEncoder:
+
+    def __init__(
+            self,
+            logger: FileLogger,
+            model: SentenceTransformer,
+            bucket_size: int,
+            max_bucket_tokens: int,
+    ) -> None:
+        self._logger = logger
+        self._model = model
+        self.bucket_size = bucket_size
+        self._max_bucket_tokens = max_bucket_tokens
+        self._lock = threading.Lock()
+        self._batch_count = 0
+        self._bucket_count = 0
+        self._real_tokens = 0
+        self._padded_tokens = 0
+        self._recent_padding_efficiency: deque[float] = deque(maxlen=20)
+
+    @classmethod
+    def from_configuration(
+            cls,
+            logger: FileLogger,
+            configuration_manager: ConfigurationManager,
+            model: SentenceTransformer,
+    ) -> EmbeddingEncoder:
+        return cls(
+            logger=logger,
+            model=model,
+            bucket_size=int(configuration_manager.get_value("embedding_encoder.bucket_size")),
+            max_bucket_tokens=int(configuration_manager.get_value("embedding_encoder.max_bucket_tokens")),
+        )
+
+    def _measure(self, texts: list[str]) -> np.ndarray:
+        encoded = self._model.tokenizer(
+            texts,
+            add_special_tokens=True,
+            truncation=True,
+            max_length=self._model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return np.fromiter((len(ids) for ids in encoded["input_ids"]), dtype=np.int64, count=len(texts))
+
+    def _create_buckets(self, lengths: np.ndarray) -> list[np.ndarray]:
+        # longest first: the first text of a bucket decides how far the others are padded
+        order = np.argsort(-lengths, kind="stable")
+        buckets = []
+        start = 0
+        while start < len(order):
+            padded_length = int(lengths[order[start]])
+            size = max(1, min(self.bucket_size, self._max_bucket_tokens // max(padded_length, 1)))
+            buckets.append(order[start:start + size])
+            start += size
+        return buckets
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        lengths = self._measure(texts)
+        embeddings: np.ndarray | None = None
+        real_tokens = int(lengths.sum())
+        padded_tokens = 0
+        buckets = self._create_buckets(lengths)
+
+        for bucket in buckets:
+            with torch.no_grad():
+                bucket_embeddings = self._model.encode(
+                    [texts[index] for index in bucket],
+                    batch_size=len(bucket),
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                )
+            if embeddings is None:
+                embeddings = np.empty((len(texts), bucket_embeddings.shape[1]), dtype=bucket_embeddings.dtype)
+            # scatter back, so callers get their rows in the original order
+            embeddings[bucket] = bucket_embeddings
+            padded_tokens += len(bucket) * int(lengths[bucket[0]])
+
+        with self._lock:
+            self._batch_count += 1
+            self._bucket_count += len(buckets)
+            self._real_tokens += real_tokens
+            self._padded_tokens += padded_tokens
+            self._recent_padding_efficiency.append(real_tokens / padded_tokens if padded_tokens else 1.0)
+
+        return embeddings
+
+    def get_statistics(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self._batch_count,
+                "buckets": self._bucket_count,
+                "real_tokens": self._real_tokens,
+                "padded_tokens": self._padded_tokens,
+                "padding_efficiency": self._real_tokens / self._padded_tokens if self._padded_tokens else 1.0,
+                "recent_batch_padding_efficiency": [round(value, 4) for value in self._recent_padding_efficiency],
+            }
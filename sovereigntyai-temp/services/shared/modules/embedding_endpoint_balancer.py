@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import requests
+
+if TYPE_CHECKING:
+    from file_logger import FileLogger
+
+
+class EmbeddingEndpointBalancer:
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            urls: list[str],
+            health_check_interval: float,
+            health_check_timeout: float,
+            failure_threshold: int,
+            ejection_time: float,
+    ) -> None:
+        if not urls:
+            raise ValueError("At least one embeddings endpoint is required.")
+
+        self._logger = logger
+        self.urls = [url.rstrip("/") for url in urls]
+        self._health_check_interval = health_check_interval
+        self._health_check_timeout = health_check_timeout
+        self._failure_threshold = failure_threshold
+        self._ejection_time = ejection_time
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._endpoints = {
+            url: {
+                "outstanding": 0,
+                "requests": 0,
+                "failures": 0,
+                "consecutive_failures": 0,
+                "ejected_until": 0.0,
+                "last_health_check": None,
+            }
+            for url in self.urls
+        }
+
+        self._stopped = threading.Event()
+        self._health_checker: threading.Thread | None = None
+        # with a single endpoint there is nothing to fail over to, so no checks are needed
+        if len(self.urls) > 1 and self._health_check_interval > 0:
+            self._health_checker = threading.Thread(
+                target=self._run_health_checks, name="embedding-health-check", daemon=True,
+            )
+            self._health_checker.start()
+
+    def acquire(self, exclude: list[str] | tuple[str, ...] = ()) -> str:
+        # least outstanding requests among healthy endpoints, ties rotate so idle replicas share the load;
+        # when every endpoint is ejected or excluded the least bad one is used rather than failing outright
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                url for url in self.urls
+                if url not in exclude and self._endpoints[url]["ejected_until"] <= now
+            ]
+            if not candidates:
+                candidates = [url for url in self.urls if url not in exclude] or self.urls
+
+            self._cursor = (self._cursor + 1) % len(self.urls)
+            # an ejection that has run out no longer counts, the endpoint competes like any other again
+            url = min(
+                candidates,
+                key=lambda candidate: (
+                    self._endpoints[candidate]["outstanding"],
+                    max(self._endpoints[candidate]["ejected_until"], now),
+                    (self.urls.index(candidate) - self._cursor) % len(self.urls),
+                ),
+            )
+            endpoint = self._endpoints[url]
+            endpoint["outstanding"] += 1
+            endpoint["requests"] += 1
+            return url
+
+    def release(self, url: str, failed: bool) -> None:
+        with self._lock:
+            endpoint = self._endpoints[url]
+            endpoint["outstanding"] -= 1
+            if not failed:
+                endpoint["consecutive_failures"] = 0
+                return
+
+            endpoint["failures"] += 1
+            endpoint["consecutive_failures"] += 1
+            if endpoint["consecutive_failures"] >= self._failure_threshold and len(self.urls) > 1:
+                self._eject(url, f"{endpoint['consecutive_failures']} consecutive failed requests")
+
+    def _eject(self, url: str, reason: str) -> None:
+        endpoint = self._endpoints[url]
+        if endpoint["ejected_until"] <= time.monotonic():
+            self._logger.warning(f"Ejecting embeddings endpoint {url} for {self._ejection_time}s: {reason}")
+        endpoint["ejected_until"] = time.monotonic() + self._ejection_time
+
+    def _check_health(self, session: requests.Session, url: str) -> str | None:
+        try:
+            response = session.get(f"{url}/status", timeout=self._health_check_timeout)
+            if response.status_code != 200:
+                return f"/status returned {response.status_code}"
+            # the embeddings service answers /status while the model is still loading
+            state = response.json().get("startup", {}).get("state", "ready")
+            if state != "ready":
+                return f"model is {state}"
+        except (requests.RequestException, ValueError) as e:
+            return str(e)
+        return None
+
+    def _run_health_checks(self) -> None:
+        session = requests.Session()
+        while not self._stopped.wait(self._health_check_interval):
+            for url in self.urls:
+                error = self._check_health(session, url)
+                with self._lock:
+                    endpoint = self._endpoints[url]
+                    endpoint["last_health_check"] = "ok" if error is None else error
+                    if error is not None:
+                        self._eject(url, f"health check failed ({error})")
+                    elif endpoint["ejected_until"] > 0:
+                        if endpoint["ejected_until"] > time.monotonic():
+                            self._logger.info(f"Embeddings endpoint {url} is healthy again")
+                        endpoint["ejected_until"] = 0.0
+                        endpoint["consecutive_failures"] = 0
+        session.close()
+
+    def get_statistics(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                url: {
+                    "healthy": endpoint["ejected_until"] <= now,
+                    "outstanding": endpoint["outstanding"],
+                    "requests": endpoint["requests"],
+                    "failures": endpoint["failures"],
+                    "consecutive_failures": endpoint["consecutive_failures"],
+                    "last_health_check": endpoint["last_health_check"],
+                }
+                for url, endpoint in self._endpoints.items()
+            }
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._health_checker is not None:
+            self._health_checker.join(timeout=self._health_check_timeout + 1)
+            self._health_checker = None
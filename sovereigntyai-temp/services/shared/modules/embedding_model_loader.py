@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+
+if TYPE_CHECKING:
+    from configuration_manager import ConfigurationManager
+    from file_logger import FileLogger
+
+
+class EmbeddingModelLoader:
+
+    MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+    BACKENDS = ("torch", "onnx", "onnx-int8")
+
+    # fixed probe set for the torch parity check, mixes short queries and longer passages
+    PARITY_TEXTS = (
+        "How do I file my income tax return?",
+        "What is the deadline for paying the real estate tax?",
+        "Tax deductions for household expenses",
+        "The tax card shows your withholding rate, which your employer uses to calculate the tax "
+        "withheld from your salary. You can change the rate in the online service if your income changes.",
+        "If you sell shares at a profit you must pay capital income tax on the gain. Losses can be "
+        "deducted from gains made in the same year and during the following five years.",
+        "Value added tax is charged on the sale of most goods and services and is included in the "
+        "final price that consumers pay.",
+    )
+
+    # token lengths the warmup batches are built from, capped at the model's max_seq_length
+    WARMUP_LENGTHS = (16, 64, 128, 256, 384, 512)
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            model_name: str,
+            cache_folder: str,
+            device: torch.device,
+            intra_op_threads: int,
+            inter_op_threads: int,
+            local_snapshot: str | None,
+            offline: bool,
+            backend: str = "torch",
+            quantization_config: str = "avx512_vnni",
+            warmup: bool = False,
+    ) -> None:
+        self._logger = logger
+        self._model_name = model_name
+        self._cache_folder = cache_folder
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._local_snapshot = Path(local_snapshot) if local_snapshot else None
+        self._offline = offline
+        self.backend = backend
+        self.quantization_config = quantization_config
+        self.device = device
+        self.warmup = warmup
+        self._export_directory = (
+            Path(cache_folder) / "onnx_exports" / model_name.replace("/", "--")
+        )
+
+    @classmethod
+    def from_configuration(
+            cls,
+            logger: FileLogger,
+            configuration_manager: ConfigurationManager,
+    ) -> EmbeddingModelLoader:
+        # the embeddings service and the in-process provider load the model the same way. The torch thread pools
+        # are sized here, because they must be set before the model runs its first forward pass; 0 keeps the default
+        intra_op_threads = int(configuration_manager.get_value("embedding_inference.intra_op_threads"))
+        inter_op_threads = int(configuration_manager.get_value("embedding_inference.inter_op_threads"))
+        if intra_op_threads > 0:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads > 0:
+            torch.set_num_interop_threads(inter_op_threads)
+
+        return cls(
+            logger=logger,
+            model_name=cls.MODEL_NAME,
+            cache_folder=configuration_manager.get_value("persistent-volume.embeddings_hf_home"),
+            device=cls.select_device(),
+            intra_op_threads=intra_op_threads,
+            inter_op_threads=inter_op_threads,
+            local_snapshot=configuration_manager.get_value("embedding_model.local_snapshot") or None,
+            offline=configuration_manager.get_value("embedding_model.offline").lower() == "true",
+            backend=configuration_manager.get_value("embedding_model.backend"),
+            quantization_config=configuration_manager.get_value("embedding_model.quantization_config"),
+            warmup=configuration_manager.get_value("embedding_model.warmup").lower() == "true",
+        )
+
+    @staticmethod
+    def select_device() -> torch.device:
+        if torch.cuda.is_available():
+            return torch.device("cuda")
+        if torch.backends.mps.is_available():
+            return torch.device("mps")
+        return torch.device("cpu")
+
+    def load(self) -> SentenceTransformer:
+        match self.backend:
+            case "torch":
+                model = self._load_torch()
+            case "onnx":
+                model = self._load_onnx(quantization_config=None)
+            case "onnx-int8":
+                model = self._load_onnx(quantization_config=self.quantization_config)
+            case _:
+                raise ValueError(f"Invalid embedding backend: {self.backend}. Expected one of {self.BACKENDS}.")
+
+        self._logger.info(f"Embedding model {self._model_name} loaded with backend '{self.backend}' on {self.device}")
+        return model
+
+    def _get_model_source(self) -> str:
+        # a snapshot directory is a plain local path, loading it never contacts the hub
+        if self._local_snapshot is None:
+            return self._model_name
+
+        if not (self._local_snapshot / "modules.json").is_file():
+            if self._offline:
+                raise FileNotFoundError(f"Model snapshot not found at {self._local_snapshot} and offline mode is on.")
+            self._logger.info(f"Materializing {self._model_name} snapshot in {self._local_snapshot}")
+            SentenceTransformer(
+                model_name_or_path=self._model_name,
+                cache_folder=self._cache_folder,
+                device="cpu",
+            ).save(str(self._local_snapshot))
+
+        return str(self._local_snapshot)
+
+    def _load_torch(self) -> SentenceTransformer:
+        model = SentenceTransformer(
+            model_name_or_path=self._get_model_source(),
+            device=str(self.device),
+            cache_folder=self._cache_folder,
+            local_files_only=self._offline,
+        )
+        model.to(self.device)
+        return model
+
+    def _create_session_options(self) -> object:
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        if self._intra_op_threads > 0:
+            session_options.intra_op_num_threads = self._intra_op_threads
+        if self._inter_op_threads > 0:
+            session_options.inter_op_num_threads = self._inter_op_threads
+        return session_options
+
+    def _load_onnx(self, quantization_config: str | None) -> SentenceTransformer:
+        # the exported graph is kept on the persistent volume, so the export only happens once
+        if not any(
+                (self._export_directory / file).is_file()
+                for file in ("model.onnx", "onnx/model.onnx")
+        ):
+            self._logger.info(f"Exporting {self._model_name} to ONNX in {self._export_directory}")
+            exported_model = SentenceTransformer(
+                model_name_or_path=self._get_model_source(),
+                backend="onnx",
+                cache_folder=self._cache_folder,
+                local_files_only=self._offline,
+            )
+            exported_model.save(str(self._export_directory))
+
+        model_kwargs = {"session_options": self._create_session_options()}
+
+        if quantization_config is not None:
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            file_name = f"onnx/model_qint8_{quantization_config}.onnx"
+            if not (self._export_directory / file_name).is_file():
+                self._logger.info(f"Quantizing ONNX graph to int8 ({quantization_config})")
+                export_dynamic_quantized_onnx_model(
+                    SentenceTransformer(str(self._export_directory), backend="onnx"),
+                    quantization_config=quantization_config,
+                    model_name_or_path=str(self._export_directory),
+                )
+            model_kwargs["file_name"] = file_name
+
+        return SentenceTransformer(
+            model_name_or_path=str(self._export_directory),
+            backend="onnx",
+            device=str(self.device),
+            model_kwargs=model_kwargs,
+        )
+
+    def warm_up(self, encode: Callable[[list[str]], np.ndarray], max_seq_length: int, batch_size: int) -> None:
+        # first calls pay for lazy kernel selection, allocator growth and tokenizer setup,
+        # so run them here over the shapes real traffic produces
+        lengths = sorted({min(length, max_seq_length) for length in self.WARMUP_LENGTHS})
+        for length in lengths:
+            text = " ".join(["warmup"] * max(length - 2, 1))
+            for size in (1, batch_size):
+                encode([text] * size)
+        self._logger.info(f"Warmup finished for lengths {lengths} and batch sizes 1 and {batch_size}")
+
+    def check_parity(self, model: SentenceTransformer, reference: SentenceTransformer | None = None) -> dict:
+        if reference is None:
+            reference = self._load_torch()
+
+        texts = list(self.PARITY_TEXTS)
+        with torch.no_grad():
+            embeddings = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+            reference_embeddings = reference.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+        deviations = 1.0 - np.sum(embeddings * reference_embeddings, axis=1)
+
+        return {
+            "texts": len(texts),
+            "mean_cosine_deviation": float(np.mean(deviations)),
+            "max_cosine_deviation": float(np.max(deviations)),
+        }
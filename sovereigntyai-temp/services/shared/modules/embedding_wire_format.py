@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import gzip
+import struct
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+
+class EmbeddingWireFormat:
+    # binary frame: header followed by the row-major little-endian matrix
+    MEDIA_TYPE = "application/x-embeddings"
+    MAGIC = b"EMBD"
+    VERSION = 1
+    HEADER = struct.Struct("<4sBBBxII")  # magic, version, dtype, compression, padding, rows, columns
+
+    DTYPES = {
+        "float32": (0, np.dtype("<f4")),
+        "float16": (1, np.dtype("<f2")),
+        # quantized frames: int8 rows are preceded by one float32 scale per row,
+        # binary rows are sign bits packed eight per byte
+        "int8": (2, np.dtype("i1")),
+        "binary": (3, np.dtype("u1")),
+    }
+    WIRE_DTYPES = ("float32", "float16")
+    QUANTIZATIONS = ("none", "float16", "int8", "binary")
+    COMPRESSIONS = {
+        "none": 0,
+        "gzip": 1,
+        "zstd": 2,
+    }
+
+    @classmethod
+    def available_compressions(cls) -> list[str]:
+        return [name for name in cls.COMPRESSIONS if name != "zstd" or zstandard is not None]
+
+    @classmethod
+    def build_accept_header(cls, dtype: str, compression: str) -> str:
+        if dtype not in cls.WIRE_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        if compression not in cls.COMPRESSIONS:
+            raise ValueError(f"Unsupported embedding compression: {compression}")
+        return f"{cls.MEDIA_TYPE}; dtype={dtype}; compression={compression}, application/json;q=0.5"
+
+    @classmethod
+    def parse_accept_header(cls, accept: str | None) -> tuple[str, str] | None:
+        # returns (dtype, compression) when the client asked for the binary frame, None for JSON
+        if not accept:
+            return None
+
+        for media_range in accept.split(","):
+            media_type, *parameters = [part.strip() for part in media_range.split(";")]
+            if media_type.lower() != cls.MEDIA_TYPE:
+                continue
+
+            options = dict(
+                parameter.split("=", 1) for parameter in parameters if "=" in parameter
+            )
+            dtype = options.get("dtype", "float32").strip().lower()
+            compression = options.get("compression", "none").strip().lower()
+
+            if dtype not in cls.WIRE_DTYPES:
+                dtype = "float32"
+            if compression not in cls.available_compressions():
+                compression = "none"
+            return dtype, compression
+
+        return None
+
+    @staticmethod
+    def normalize(embeddings: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    @classmethod
+    def prepare(cls, embeddings: np.ndarray, normalize: bool, quantization: str) -> np.ndarray:
+        # quantized outputs are always L2-normalized, so one scale/sign convention fits every vector
+        if normalize or quantization != "none":
+            return cls.normalize(embeddings)
+        return embeddings
+
+    @staticmethod
+    def quantize_int8(embeddings: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # symmetric per-vector scale, the largest component maps to +/-127
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales = np.where(scales > 0, scales, 1).astype(np.float32)
+        values = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+        return values, scales
+
+    @staticmethod
+    def dequantize_int8(values: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        return values.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+    @staticmethod
+    def pack_binary(embeddings: np.ndarray) -> np.ndarray:
+        return np.packbits(embeddings > 0, axis=1)
+
+    @staticmethod
+    def unpack_binary(packed: np.ndarray, columns: int) -> np.ndarray:
+        # signs scaled to unit length, so cosine and inner product behave like on the float vectors
+        bits = np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=1, count=columns)
+        return (bits.astype(np.float32) * 2 - 1) / np.sqrt(columns, dtype=np.float32)
+
+    @classmethod
+    def quantize_for_json(cls, embeddings: np.ndarray, quantization: str) -> tuple[list, list[float] | None]:
+        # the rows and, for int8, the scales as the JSON responses carry them
+        match quantization:
+            case "float16":
+                return embeddings.astype(np.float16).tolist(), None
+            case "int8":
+                values, scales = cls.quantize_int8(embeddings)
+                return values.tolist(), scales.tolist()
+            case "binary":
+                return cls.pack_binary(embeddings).tolist(), None
+            case _:
+                return embeddings.tolist(), None
+
+    @classmethod
+    def encode(cls, embeddings: np.ndarray, dtype: str = "float32", compression: str = "none") -> bytes:
+        if embeddings.ndim != 2:
+            raise ValueError(f"Expected a 2-dimensional embedding matrix, got shape {embeddings.shape}")
+
+        dtype_code, numpy_dtype = cls.DTYPES[dtype]
+        compression_code = cls.COMPRESSIONS[compression]
+        rows, columns = embeddings.shape
+
+        match dtype:
+            case "int8":
+                values, scales = cls.quantize_int8(embeddings)
+                payload = scales.astype("<f4").tobytes() + values.tobytes()
+            case "binary":
+                payload = cls.pack_binary(embeddings).tobytes()
+            case _:
+                payload = np.ascontiguousarray(embeddings, dtype=numpy_dtype).tobytes()
+
+        match compression:
+            case "gzip":
+                payload = gzip.compress(payload, compresslevel=1)
+            case "zstd":
+                if zstandard is None:
+                    raise ValueError("zstd compression requested but the 'zstandard' package is not installed.")
+                payload = zstandard.ZstdCompressor(level=1).compress(payload)
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, dtype_code, compression_code, rows, columns)
+        return header + payload
+
+    @classmethod
+    def decode(cls, data: bytes) -> np.ndarray:
+        # float frames are returned as views on the received bytes, quantized frames are expanded to float32
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Embedding frame is shorter than its header.")
+
+        magic, version, dtype_code, compression_code, rows, columns = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"Unsupported embedding frame (magic={magic!r}, version={version}).")
+
+        dtype = next((name for name, (code, _) in cls.DTYPES.items() if code == dtype_code), None)
+        if dtype is None:
+            raise ValueError(f"Unsupported embedding dtype code: {dtype_code}")
+
+        payload = memoryview(data)[cls.HEADER.size:]
+        match compression_code:
+            case 0:
+                pass
+            case 1:
+                payload = gzip.decompress(payload)
+            case 2:
+                if zstandard is None:
+                    raise ValueError("Received zstd frame but the 'zstandard' package is not installed.")
+                payload = zstandard.ZstdDecompressor().decompress(payload)
+            case _:
+                raise ValueError(f"Unsupported embedding compression code: {compression_code}")
+
+        numpy_dtype = cls.DTYPES[dtype][1]
+        match dtype:
+            case "int8":
+                scales = np.frombuffer(payload, dtype="<f4", count=rows)
+                values = np.frombuffer(payload, dtype=numpy_dtype, count=rows * columns, offset=4 * rows)
+                return cls.dequantize_int8(values.reshape(rows, columns), scales)
+            case "binary":
+                packed_columns = (columns + 7) // 8
+                packed = np.frombuffer(payload, dtype=numpy_dtype, count=rows * packed_columns)
+                return cls.unpack_binary(packed.reshape(rows, packed_columns), columns)
+            case _:
+                # np.frombuffer wraps the received bytes without copying them
+                return np.frombuffer(payload, dtype=numpy_dtype, count=rows * columns).reshape(rows, columns)
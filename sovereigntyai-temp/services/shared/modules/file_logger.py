@@ -54,6 +54,21 @@ class FileLogger:
     def set_job_id(self, job_id: str) -> None:
         self._formatter.set_job_id(job_id)
 
+    def debug(self, message: str) -> None:
+        self.logger.debug(message, stacklevel=2)
+
+    def info(self, message: str) -> None:
+        self.logger.info(message, stacklevel=2)
+
+    def warning(self, message: str) -> None:
+        self.logger.warning(message, stacklevel=2)
+
+    def error(self, message: str) -> None:
+        self.logger.error(message, stacklevel=2)
+
+    def exception(self, message: str) -> None:
+        self.logger.exception(message, stacklevel=2)
+
     @staticmethod
     def _get_logging_level(level_str: str) -> int:
         level_str = level_str.upper()
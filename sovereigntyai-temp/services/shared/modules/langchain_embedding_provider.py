@@ -1,8 +1,19 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Iterator
+import asyncio
+import itertools
+import json
 
+import httpx
+import numpy as np
 import requests
 from langchain_core.embeddings import Embeddings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from modules.embedding_endpoint_balancer import EmbeddingEndpointBalancer
+from modules.embedding_wire_format import EmbeddingWireFormat
 
 if TYPE_CHECKING:
     from configuration_manager import ConfigurationManager
@@ -25,16 +36,332 @@ class LangchainEmbeddingProvider(Embeddings):
         self._configuration_manager = configuration_manager
         self._secret_manager = secret_manager
 
-        self.api_url = configuration_manager.get_value("langchain_embedding_provider.api_url")
+        self._balancer = EmbeddingEndpointBalancer(
+            logger=logger,
+            urls=configuration_manager.get_values("langchain_embedding_provider.api_url"),
+            health_check_interval=float(
+                configuration_manager.get_value("embedding_endpoint_balancer.health_check_interval")
+            ),
+            health_check_timeout=float(
+                configuration_manager.get_value("embedding_endpoint_balancer.health_check_timeout")
+            ),
+            failure_threshold=int(configuration_manager.get_value("embedding_endpoint_balancer.failure_threshold")),
+            ejection_time=float(configuration_manager.get_value("embedding_endpoint_balancer.ejection_time")),
+        )
+        self._headers = self._create_headers()
+        self._normalize = configuration_manager.get_value("langchain_embedding_provider.normalize").lower() == "true"
+        self._quantization = configuration_manager.get_value("langchain_embedding_provider.quantization")
+        if self._quantization not in EmbeddingWireFormat.QUANTIZATIONS:
+            raise ValueError(f"Invalid embedding quantization: {self._quantization}")
+        self._stream_window_size = int(
+            configuration_manager.get_value("langchain_embedding_provider.stream_window_size")
+        )
+        self._timeout = (
+            float(configuration_manager.get_value("langchain_embedding_provider.connect_timeout")),
+            float(configuration_manager.get_value("langchain_embedding_provider.read_timeout")),
+        )
+        self._pool_size = int(configuration_manager.get_value("langchain_embedding_provider.pool_size"))
+        self._max_retries = int(configuration_manager.get_value("langchain_embedding_provider.max_retries"))
+        self._retry_backoff_factor = float(
+            configuration_manager.get_value("langchain_embedding_provider.retry_backoff_factor")
+        )
+        self._max_batch_size = int(configuration_manager.get_value("langchain_embedding_provider.max_batch_size"))
+        self._max_batch_bytes = int(configuration_manager.get_value("langchain_embedding_provider.max_batch_bytes"))
+        self._max_in_flight = int(configuration_manager.get_value("langchain_embedding_provider.max_in_flight"))
+        self._session = self._create_session()
+        self._fan_out_executor = ThreadPoolExecutor(
+            max_workers=self._max_in_flight, thread_name_prefix="embedding-fan-out",
+        )
+        # created on first use, an httpx.AsyncClient and its pooled connections belong to the event loop it runs on
+        self._async_client: httpx.AsyncClient | None = None
+        self._async_client_loop: asyncio.AbstractEventLoop | None = None
+
+    _RETRY_STATUSES = (500, 502, 503, 504)
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self._max_retries,
+            backoff_factor=self._retry_backoff_factor,
+            status_forcelist=self._RETRY_STATUSES,
+            # embedding requests have no side effects, so POSTs are safe to repeat
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get_pool_statistics(self) -> dict:
+        statistics = {}
+        for scheme in ("http://", "https://"):
+            adapter = self._session.get_adapter(scheme)
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                idle = pool.pool.qsize() if pool.pool is not None else 0
+                statistics[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "max_size": pool.pool.maxsize if pool.pool is not None else 0,
+                    "idle": idle,
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests,
+                }
+        return statistics
+
+    def get_endpoint_statistics(self) -> dict:
+        return self._balancer.get_statistics()
+
+    def _create_headers(self) -> dict[str, str]:
+        wire_format = self._configuration_manager.get_value("langchain_embedding_provider.wire_format")
+        if wire_format == "json":
+            return {}
+        if wire_format != "binary":
+            raise ValueError(f"Invalid embedding wire format: {wire_format}")
+
+        dtype = self._configuration_manager.get_value("langchain_embedding_provider.wire_dtype")
+        compression = self._configuration_manager.get_value("langchain_embedding_provider.wire_compression")
+        if compression not in EmbeddingWireFormat.available_compressions():
+            self._logger.warning(f"Embedding compression '{compression}' is not available, using 'none'.")
+            compression = "none"
+
+        return {"Accept": EmbeddingWireFormat.build_accept_header(dtype, compression)}
+
+    def _create_payload(self, payload: dict) -> dict:
+        return {**payload, "normalize": self._normalize, "quantization": self._quantization}
+
+    def _decode_response(self, response: requests.Response | httpx.Response, json_key: str) -> np.ndarray:
+        if response.headers.get("content-type", "").startswith(EmbeddingWireFormat.MEDIA_TYPE):
+            return EmbeddingWireFormat.decode(response.content)
+
+        # JSON fallback for services that do not speak the binary frame
+        return self._decode_json(response.json(), json_key)
+
+    def _post(self, path: str, payload: dict, json_key: str) -> np.ndarray:
+        payload = self._create_payload(payload)
+        tried: list[str] = []
+
+        # the session retries on the chosen replica; once those retries are spent, fail over to the next one
+        while True:
+            url = self._balancer.acquire(exclude=tried)
+            tried.append(url)
+            can_fail_over = len(tried) < len(self._balancer.urls)
+            try:
+                response = self._session.post(
+                    f"{url}/{path}", json=payload, headers=self._headers, timeout=self._timeout,
+                )
+            except requests.RequestException as e:
+                self._balancer.release(url, failed=True)
+                if not can_fail_over:
+                    raise
+                self._logger.warning(f"Embedding request to {url}/{path} failed ({e}), trying another endpoint.")
+                continue
+
+            failed = response.status_code in self._RETRY_STATUSES
+            self._balancer.release(url, failed=failed)
+            if failed and can_fail_over:
+                self._logger.warning(
+                    f"Embedding request to {url}/{path} returned {response.status_code}, trying another endpoint."
+                )
+                continue
+
+            response.raise_for_status()
+            return self._decode_response(response, json_key)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # the connections of a client can only be closed on its own loop, which may be closed already when another
+        # loop comes along, so other loops are rejected instead of getting a client of their own that leaks them
+        loop = asyncio.get_running_loop()
+        if self._async_client is not None and self._async_client_loop is not loop:
+            raise RuntimeError(
+                "The async embedding client belongs to another event loop, call aclose() on that loop first."
+            )
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                # pool_size is per host, like the sync adapter's pools
+                limits=httpx.Limits(
+                    max_connections=self._pool_size * len(self._balancer.urls),
+                    max_keepalive_connections=self._pool_size * len(self._balancer.urls),
+                ),
+                timeout=httpx.Timeout(self._timeout[1], connect=self._timeout[0]),
+            )
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def _apost(self, path: str, payload: dict, json_key: str) -> np.ndarray:
+        client = self._get_async_client()
+        payload = self._create_payload(payload)
+
+        # same policy as the sync session: retry connection errors and 5xx with exponential backoff,
+        # each attempt preferring an endpoint that has not failed this request yet
+        failed_urls: list[str] = []
+        for attempt in range(self._max_retries + 1):
+            retries_left = attempt < self._max_retries
+            url = self._balancer.acquire(exclude=failed_urls)
+            try:
+                response = await client.post(f"{url}/{path}", json=payload, headers=self._headers)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadError, httpx.RemoteProtocolError) as e:
+                self._balancer.release(url, failed=True)
+                if not retries_left:
+                    raise
+                self._logger.warning(f"Embedding request to {url}/{path} failed ({e}), retrying.")
+            except BaseException:
+                self._balancer.release(url, failed=False)
+                raise
+            else:
+                failed = response.status_code in self._RETRY_STATUSES
+                self._balancer.release(url, failed=failed)
+                if not failed or not retries_left:
+                    response.raise_for_status()
+                    return self._decode_response(response, json_key)
+                self._logger.warning(f"Embedding request to {url}/{path} returned {response.status_code}, retrying.")
+
+            failed_urls.append(url)
+
+            await asyncio.sleep(self._retry_backoff_factor * 2 ** attempt)
+
+    async def aclose(self) -> None:
+        # afterwards another event loop may use the async methods
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_client_loop = None
+
+    @staticmethod
+    def _decode_json(body: dict, json_key: str) -> np.ndarray:
+        # /embed_query answers a single row, /embed_documents a list of rows that is empty for no texts
+        rows = [body[json_key]] if json_key == "embedding" else body[json_key]
+        dimensions = int(body["dimensions"])
+        match body.get("quantization", "none"):
+            case "int8":
+                scales = body["scales"] if body.get("scales") is not None else [body["scale"]]
+                values = np.asarray(rows, dtype=np.int8).reshape(len(rows), dimensions)
+                return EmbeddingWireFormat.dequantize_int8(values, np.asarray(scales, dtype=np.float32))
+            case "binary":
+                packed = np.asarray(rows, dtype=np.uint8).reshape(len(rows), (dimensions + 7) // 8)
+                return EmbeddingWireFormat.unpack_binary(packed, dimensions)
+            case _:
+                return np.asarray(rows, dtype=np.float32).reshape(len(rows), dimensions)
+
+    def _create_sub_batches(self, texts: list[str]) -> list[tuple[int, int]]:
+        # (start, end) ranges bounded by text count and UTF-8 payload size; a single text larger
+        # than the byte limit still gets a sub-batch of its own
+        sub_batches = []
+        start = 0
+        size = 0
+        for index, text in enumerate(texts):
+            text_size = len(text.encode("utf-8"))
+            if index > start and (index - start >= self._max_batch_size or size + text_size > self._max_batch_bytes):
+                sub_batches.append((start, index))
+                start = index
+                size = 0
+            size += text_size
+        if start < len(texts):
+            sub_batches.append((start, len(texts)))
+        return sub_batches
+
+    def _embed_sub_batch(self, texts: list[str], start: int, end: int) -> np.ndarray:
+        # every sub-batch is its own request with its own retries, a failure never redoes the others
+        try:
+            return self._post("embed_documents", {"texts": texts[start:end]}, "embeddings")
+        except Exception as e:
+            self._logger.error(f"Embedding of texts {start}-{end} of {len(texts)} failed: {e}")
+            raise
+
+    def embed_documents_as_array(self, texts: list[str]) -> np.ndarray:
+        sub_batches = self._create_sub_batches(texts)
+        if len(sub_batches) <= 1:
+            return self._post("embed_documents", {"texts": texts}, "embeddings")
+
+        futures = [
+            self._fan_out_executor.submit(self._embed_sub_batch, texts, start, end) for start, end in sub_batches
+        ]
+        try:
+            return np.concatenate([future.result() for future in futures])
+        finally:
+            for future in futures:
+                future.cancel()
 
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
-        payload = {"texts": texts}
-        response = requests.post(f"{self.api_url}/embed_documents", json=payload)
-        response.raise_for_status()
-        return response.json()["embeddings"]
+        return self.embed_documents_as_array(texts).tolist()
 
     def embed_query(self, text: str) -> list[float]:
-        payload = {"text": text}
-        response = requests.post(f"{self.api_url}/embed_query", json=payload)
-        response.raise_for_status()
-        return response.json()["embedding"]
+        embedding = self._post("embed_query", {"text": text}, "embedding")
+        return embedding.reshape(-1).tolist()
+
+    async def _aembed_sub_batch(
+            self, texts: list[str], start: int, end: int, in_flight: asyncio.Semaphore,
+    ) -> np.ndarray:
+        async with in_flight:
+            try:
+                return await self._apost("embed_documents", {"texts": texts[start:end]}, "embeddings")
+            except Exception as e:
+                self._logger.error(f"Embedding of texts {start}-{end} of {len(texts)} failed: {e}")
+                raise
+
+    async def aembed_documents_as_array(self, texts: list[str]) -> np.ndarray:
+        sub_batches = self._create_sub_batches(texts)
+        if len(sub_batches) <= 1:
+            return await self._apost("embed_documents", {"texts": texts}, "embeddings")
+
+        in_flight = asyncio.Semaphore(self._max_in_flight)
+        tasks = [
+            asyncio.create_task(self._aembed_sub_batch(texts, start, end, in_flight)) for start, end in sub_batches
+        ]
+        try:
+            return np.concatenate(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return (await self.aembed_documents_as_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        embedding = await self._apost("embed_query", {"text": text}, "embedding")
+        return embedding.reshape(-1).tolist()
+
+    def embed_documents_stream(self, items: Iterable[tuple[str, str]]) -> Iterator[tuple[str, list[float]]]:
+        # items are (id, text) pairs; each window is one streaming request, so memory stays
+        # bounded by the window size while results arrive batch by batch
+        iterator = iter(items)
+        while window := list(itertools.islice(iterator, self._stream_window_size)):
+            yield from self._stream_window(window)
+
+    def _stream_window(self, window: list[tuple[str, str]]) -> Iterator[tuple[str, list[float]]]:
+        # bytes and not a generator: the session retries 5xx responses and must be able to send the body again
+        body = b"".join(json.dumps({"id": item_id, "text": text}).encode("utf-8") + b"\n" for item_id, text in window)
+        pending = {item_id for item_id, _ in window}
+
+        url = self._balancer.acquire()
+        failed = False
+        try:
+            with self._session.post(
+                    f"{url}/embed_documents_stream",
+                    # the same options as embed_documents, so both give the same vectors
+                    params={"normalize": str(self._normalize).lower(), "quantization": self._quantization},
+                    data=body,
+                    headers={"Content-Type": "application/x-ndjson"},
+                    stream=True,
+                    timeout=self._timeout,
+            ) as response:
+                failed = response.status_code in self._RETRY_STATUSES
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if "error" in record:
+                        raise ValueError(f"Embedding of item {record.get('id')} failed: {record['error']}")
+                    pending.discard(record["id"])
+                    yield record["id"], self._decode_json(record, "embedding")[0].tolist()
+            # a stream cut short still ends with 200, the missing items must not pass silently
+            if pending:
+                raise ValueError(
+                    f"Embedding stream from {url} ended without {len(pending)} of {len(window)} items."
+                )
+        except requests.RequestException:
+            failed = True
+            raise
+        finally:
+            self._balancer.release(url, failed=failed)
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 import time
-import langdetect
 import shortuuid
 from langchain_groq import ChatGroq
 from langchain_postgres.vectorstores import PGVector
@@ -12,6 +11,8 @@ from langchain.prompts import PromptTemplate
 
 from langchain_ollama.chat_models import ChatOllama
 
+from modules.language_identifier import LanguageIdentifier
+
 if TYPE_CHECKING:
     from configuration_manager import ConfigurationManager
     from file_logger import FileLogger
@@ -42,6 +43,13 @@ class LangchainLlmClient:
         self._max_tokens = max_tokens
         self._langchain_vector_store = langchain_vector_store
         self._collection_name = collection_name
+        # loaded here, so the first question does not wait for the language profiles
+        self._language_identifier = LanguageIdentifier(
+            sample_size=int(self._configuration_manager.get_value("language_identifier.sample_size")),
+            seed=int(self._configuration_manager.get_value("language_identifier.seed")),
+            languages=self._configuration_manager.get_values("language_identifier.languages"),
+        )
+        self._language_identifier.load()
 
         # if not os.getenv("ENVIRONMENT") == "local":
 
@@ -66,15 +74,10 @@ class LangchainLlmClient:
         #         client_kwargs={"timeout": 60},
         #     )
 
-    @staticmethod
-    def _detect_language(text: str) -> str:
-        try:
-            language = langdetect.detect(text)
-        except langdetect.lang_detect_exception.LangDetectException:
-            language = None
-        return language
+    def _detect_language(self, text: str) -> str | None:
+        return self._language_identifier.detect(text)
 
-    def ask_database(
+    async def ask_database(
             self,
             k: int,
             score_threshold: float,
@@ -117,7 +120,7 @@ class LangchainLlmClient:
 
         # self._logger.info(f"Retriever created: {time.perf_counter() - start_time}")
 
-        documents = retriever.get_relevant_documents(question)
+        documents = await retriever.ainvoke(question)
 
         # self._logger.info(f"Documents received: {time.perf_counter() - start_time}")
 
@@ -155,7 +158,7 @@ class LangchainLlmClient:
             try:
 
                 # self._logger.info(f"Chain invoke: {time.perf_counter() - start_time}")
-                result = chain.invoke(
+                result = await chain.ainvoke(
                     {"input": question, "max_output_length": 1500},
                 )
                 # self._logger.info(f"Answer received: {time.perf_counter() - start_time}")
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+import threading
+
+from langdetect.detector_factory import PROFILES_DIRECTORY, DetectorFactory
+from langdetect.lang_detect_exception import LangDetectException
+
+
+class LanguageIdentifier:
+    # langdetect on a bounded sample of the text with a fixed seed: the same text always gets the same language,
+    # and a whole file costs no more than a paragraph
+
+    # loading the profiles is the slow part of langdetect, they are loaded once per process and configuration
+    _factories: dict[tuple[tuple[str, ...], int], DetectorFactory] = {}
+    _factories_lock = threading.Lock()
+
+    def __init__(self, sample_size: int, seed: int, languages: list[str] | None = None) -> None:
+        if sample_size <= 0:
+            raise ValueError(f"Invalid language identification sample size: {sample_size}")
+        self._sample_size = sample_size
+        self._seed = seed
+        # no languages loads every profile langdetect ships
+        self._languages = tuple(sorted(languages or ()))
+
+    def load(self) -> None:
+        self._get_factory()
+
+    def _get_factory(self) -> DetectorFactory:
+        key = (self._languages, self._seed)
+        factory = self._factories.get(key)
+        if factory is not None:
+            return factory
+
+        with self._factories_lock:
+            factory = self._factories.get(key)
+            if factory is None:
+                factory = DetectorFactory()
+                if self._languages:
+                    profiles = []
+                    for language in self._languages:
+                        with open(os.path.join(PROFILES_DIRECTORY, language), encoding="utf-8") as f:
+                            profiles.append(f.read())
+                    factory.load_json_profile(profiles)
+                else:
+                    factory.load_profile(PROFILES_DIRECTORY)
+                factory.set_seed(self._seed)
+                self._factories[key] = factory
+        return factory
+
+    def _sample(self, text: str) -> str:
+        # windows from the start, the middle and the end, so a long file is not judged by its header alone
+        if len(text) <= self._sample_size:
+            return text
+        window = self._sample_size // 3
+        starts = (0, (len(text) - window) // 2, len(text) - window)
+        return " ".join(text[start:start + window] for start in starts)
+
+    def detect_file(self, file: str) -> str | None:
+        # a file of up to 4 bytes per character of the sample is read whole, detect samples it like its text. A
+        # larger one has more characters than the sample, its windows are read with seeks at the offsets _sample
+        # uses, so a file of any size is never loaded whole
+        size = os.path.getsize(file)
+        with open(file, "rb") as f:
+            if size <= 4 * self._sample_size:
+                return self.detect(self._decode(f.read()))
+            window = self._sample_size // 3
+            windows = []
+            for start in (0, (size - window) // 2, size - window):
+                f.seek(start)
+                # a window may start or end inside a multibyte character
+                windows.append(self._decode(f.read(window)))
+        return self.detect(" ".join(windows))
+
+    @staticmethod
+    def _decode(data: bytes) -> str:
+        return data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+    def detect(self, text: str) -> str | None:
+        detector = self._get_factory().create()
+        detector.set_max_text_length(self._sample_size)
+        detector.append(self._sample(text))
+        try:
+            return detector.detect()
+        except LangDetectException:
+            return None
+
+
+if __name__ == "__main__":
+    # micro-benchmark against langdetect.detect on the whole text, run from services/shared:
+    #   python -m modules.language_identifier [file ...]
+    import statistics
+    import sys
+    import time
+
+    import langdetect
+
+    def measure(detect, text: str, repeat: int) -> tuple[str, int, float, float]:
+        # distinct counts the different answers over the runs, langdetect.detect is not seeded
+        languages, timings = [], []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            languages.append(detect(text))
+            timings.append((time.perf_counter() - started_at) * 1000)
+        return languages[-1] or "-", len(set(languages)), statistics.median(timings), max(timings)
+
+    questions = {
+        "question": "How is the capital gains tax calculated when I sell shares that I inherited?",
+        "question (short)": "verokortti muutos",
+    }
+    paragraph = (
+        "The tax administration collects income tax, value added tax and the inheritance tax. "
+        "A taxpayer who sells shares pays tax on the capital gain, which is the selling price "
+        "minus the acquisition cost and the expenses of the sale.\n\n"
+    )
+    documents = {"document (synthetic)": paragraph * 500}
+    for path in sys.argv[1:]:
+        with open(path, encoding="utf-8") as file:
+            documents[f"document ({os.path.basename(path)})"] = file.read()
+
+    started_at = time.perf_counter()
+    identifier = LanguageIdentifier(sample_size=2000, seed=0)
+    identifier.load()
+    print(f"profiles loaded in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+    langdetect.detect("warm up the langdetect default factory")
+
+    row = "{:<28}{:>8}  {:<20}{:>9}{:>9}{:>11}{:>9}"
+    print(row.format("input", "chars", "implementation", "language", "distinct", "median ms", "max ms"))
+    for name, text in {**questions, **documents}.items():
+        for implementation, detect in (
+                ("langdetect.detect", langdetect.detect),
+                ("LanguageIdentifier", identifier.detect),
+        ):
+            language, distinct, median, maximum = measure(detect, text, repeat=200 if name in questions else 20)
+            print(row.format(name, len(text), implementation, language, distinct, f"{median:.2f}", f"{maximum:.2f}"))
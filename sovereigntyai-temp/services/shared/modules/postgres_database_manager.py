@@ -3,6 +3,8 @@ from typing import TYPE_CHECKING
 
 from langchain_core.embeddings import Embeddings
 from langchain_postgres.vectorstores import PGVector
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 
 if TYPE_CHECKING:
     from configuration_manager import ConfigurationManager
@@ -26,18 +28,24 @@ class PostgresDatabaseManager:
         self._secret_manager = secret_manager
         self._embeddings = embeddings
 
-    def create_langchain_vector_store(self, collection_name: str) -> PGVector:
+    def _create_connection_string(self) -> str:
         host = self._configuration_manager.get_value("postgres_database_manager.host")
         port = self._configuration_manager.get_value("postgres_database_manager.port")
         database_name = self._configuration_manager.get_value("postgres_database_manager.database_name")
         user = self._configuration_manager.get_value("postgres_database_manager.user")
         password = self._secret_manager.get_secret("DB_PASSWORD")
 
-        connection = f"postgresql+psycopg://{user}:{password}@{host}:{port}/{database_name}"
+        return f"postgresql+psycopg://{user}:{password}@{host}:{port}/{database_name}"
 
+    def create_engine(self) -> Engine:
+        return create_engine(self._create_connection_string(), pool_pre_ping=True)
+
+    def create_langchain_vector_store(self, collection_name: str, async_mode: bool = False) -> PGVector:
+        # an async store only serves the a* methods, a sync one only the plain ones
         return PGVector(
             embeddings=self._embeddings,
-            connection=connection,
+            connection=self._create_connection_string(),
             collection_name=collection_name,
             use_jsonb=True,
+            async_mode=async_mode,
         )
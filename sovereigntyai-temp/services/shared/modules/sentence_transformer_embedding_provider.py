@@ -0,0 +1,127 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Iterator
+import asyncio
+import itertools
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from modules.embedding_encoder import EmbeddingEncoder
+from modules.embedding_model_loader import EmbeddingModelLoader
+from modules.embedding_wire_format import EmbeddingWireFormat
+
+if TYPE_CHECKING:
+    from configuration_manager import ConfigurationManager
+    from file_logger import FileLogger
+    from os_environment_secret_manager import OsEnvironmentSecretManager
+
+
+class SentenceTransformerEmbeddingProvider(Embeddings):
+    # runs the embeddings service's model in this process, for deployments where every service shares one host
+
+    def __init__(  # noqa: PLR0913
+            self,
+            logger: FileLogger,
+            secret_manager: OsEnvironmentSecretManager,
+            configuration_manager: ConfigurationManager,
+
+    ) -> None:
+        super().__init__()
+        self._logger = logger
+        self._configuration_manager = configuration_manager
+        self._secret_manager = secret_manager
+
+        self._normalize = configuration_manager.get_value("langchain_embedding_provider.normalize").lower() == "true"
+        self._quantization = configuration_manager.get_value("langchain_embedding_provider.quantization")
+        if self._quantization not in EmbeddingWireFormat.QUANTIZATIONS:
+            raise ValueError(f"Invalid embedding quantization: {self._quantization}")
+        # vectors take the same precision they would have after the trip over the wire
+        self._wire_dtype = (
+            configuration_manager.get_value("langchain_embedding_provider.wire_dtype")
+            if configuration_manager.get_value("langchain_embedding_provider.wire_format") == "binary"
+            else "float32"
+        )
+        self._max_batch_size = int(configuration_manager.get_value("langchain_embedding_provider.max_batch_size"))
+        self._stream_window_size = int(
+            configuration_manager.get_value("langchain_embedding_provider.stream_window_size")
+        )
+
+        # the same model, backend and encoder settings as the embeddings service
+        model_loader = EmbeddingModelLoader.from_configuration(logger=logger, configuration_manager=configuration_manager)
+        self._backend = model_loader.backend
+        self._device = model_loader.device
+        self._model = model_loader.load()
+        self._encoder = EmbeddingEncoder.from_configuration(
+            logger=logger, configuration_manager=configuration_manager, model=self._model,
+        )
+
+        max_concurrency = int(configuration_manager.get_value("embedding_inference.max_concurrency"))
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding-inference")
+
+        if model_loader.warmup:
+            model_loader.warm_up(
+                encode=self._encoder.encode,
+                max_seq_length=self._model.max_seq_length,
+                batch_size=self._encoder.bucket_size,
+            )
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self._model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        with self._slots:
+            embeddings = np.asarray(self._encoder.encode(texts), dtype=np.float32)
+
+        embeddings = EmbeddingWireFormat.prepare(embeddings, self._normalize, self._quantization)
+        # the frame round trip applies exactly the rounding the HTTP client decodes, so vectors from
+        # both modes are interchangeable in the same index
+        dtype = self._quantization if self._quantization != "none" else self._wire_dtype
+        return EmbeddingWireFormat.decode(EmbeddingWireFormat.encode(embeddings, dtype=dtype))
+
+    def get_pool_statistics(self) -> dict:
+        return {}
+
+    def get_endpoint_statistics(self) -> dict:
+        return {
+            "in-process": {
+                "backend": self._backend,
+                "device": str(self._device),
+                "encoder": self._encoder.get_statistics(),
+            },
+        }
+
+    def embed_documents_as_array(self, texts: list[str]) -> np.ndarray:
+        if len(texts) <= self._max_batch_size:
+            return self._encode(texts)
+        return np.concatenate([
+            self._encode(texts[start:start + self._max_batch_size])
+            for start in range(0, len(texts), self._max_batch_size)
+        ])
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents_as_array(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._encode([text]).reshape(-1).tolist()
+
+    async def aembed_documents_as_array(self, texts: list[str]) -> np.ndarray:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed_documents_as_array, texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return (await self.aembed_documents_as_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.embed_query, text)
+
+    async def aclose(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def embed_documents_stream(self, items: Iterable[tuple[str, str]]) -> Iterator[tuple[str, list[float]]]:
+        iterator = iter(items)
+        while window := list(itertools.islice(iterator, self._stream_window_size)):
+            embeddings = self.embed_documents_as_array([text for _, text in window])
+            for (item_id, _), embedding in zip(window, embeddings):
+                yield item_id, embedding.tolist()